@@ -0,0 +1,212 @@
+"""
+Synthetic permission graphs and timed scenarios for the restricted overrides.
+
+``generate_dataset`` fills the database with bulk inserts; ``run_benchmarks``
+times every override on it and returns one result dictionary per scenario.
+"""
+import random
+import time
+from collections import namedtuple
+from django.contrib.admin.options import ModelAdmin
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User, Group, Permission
+from django.contrib.sites.models import Site
+from django.db import connection, reset_queries
+from django.test.client import RequestFactory
+from cms.models.permissionmodels import GlobalPagePermission
+from restricted_model_admin.decorators import restricted_overrides
+from restricted_model_admin.policy import QUERYSET_STRATEGIES
+from restricted_model_admin.test_model import TestModel
+
+
+Dataset = namedtuple('Dataset', 'sizes staff_user_ids superuser_id object_ids')
+
+DEFAULT_SIZES = {
+    'sites': 100,
+    'users': 50,
+    'groups': 10,
+    'permissions': 100,
+    'objects': 1000,
+}
+
+
+def generate_dataset(sites, users, groups, permissions, objects,
+                     max_object_sites=5, max_permission_sites=10,
+                     max_user_groups=2, pbs_provided=0.1, read_only=0.1,
+                     orphans=0.05, seed=0):
+    """Bulk inserts a random permission graph: ``sites`` sites, ``users``
+    staff users spread over ``groups`` groups, ``permissions``
+    GlobalPagePermissions granted to users or groups and ``objects``
+    TestModel rows linked to up to ``max_object_sites`` sites each.
+    """
+    rnd = random.Random(seed)
+    Site.objects.bulk_create([
+        Site(domain='bench%d.example.org' % i, name='bench %d' % i)
+        for i in range(sites)])
+    site_ids = list(Site.objects.values_list('pk', flat=True))
+
+    User.objects.bulk_create([
+        User(username='bench%d' % i, is_staff=True) for i in range(users)])
+    User.objects.bulk_create([
+        User(username='benchadmin', is_staff=True, is_superuser=True)])
+    staff_user_ids = list(User.objects.filter(is_superuser=False)
+                                      .values_list('pk', flat=True))
+    superuser_id = User.objects.get(username='benchadmin').pk
+    change_permission = Permission.objects.get(codename='change_testmodel')
+    User.user_permissions.through.objects.bulk_create([
+        User.user_permissions.through(user_id=user_id,
+                                      permission_id=change_permission.pk)
+        for user_id in staff_user_ids])
+
+    Group.objects.bulk_create([Group(name='bench%d' % i) for i in range(groups)])
+    group_ids = list(Group.objects.values_list('pk', flat=True))
+    memberships = set()
+    for user_id in staff_user_ids:
+        for group_id in rnd.sample(group_ids, rnd.randint(0, min(max_user_groups, len(group_ids)))):
+            memberships.add((user_id, group_id))
+    User.groups.through.objects.bulk_create([
+        User.groups.through(user_id=user_id, group_id=group_id)
+        for user_id, group_id in memberships])
+
+    GlobalPagePermission.objects.bulk_create([
+        GlobalPagePermission(user_id=rnd.choice(staff_user_ids))
+        if not group_ids or rnd.random() < 0.5 else
+        GlobalPagePermission(group_id=rnd.choice(group_ids))
+        for i in range(permissions)])
+    GlobalPagePermission.sites.through.objects.bulk_create([
+        GlobalPagePermission.sites.through(globalpagepermission_id=permission_id,
+                                           site_id=site_id)
+        for permission_id in GlobalPagePermission.objects.values_list('pk', flat=True)
+        for site_id in rnd.sample(site_ids, rnd.randint(1, min(max_permission_sites, len(site_ids))))])
+
+    TestModel.objects.bulk_create([
+        TestModel(test_field1='bench%d' % i,
+                  test_field2='benchmark object %d ' % i * 10,
+                  pbs_provided=rnd.random() < pbs_provided,
+                  read_only=rnd.random() < read_only)
+        for i in range(objects)])
+    object_ids = list(TestModel.objects.values_list('pk', flat=True))
+    TestModel.sites.through.objects.bulk_create([
+        TestModel.sites.through(testmodel_id=object_id, site_id=site_id)
+        for object_id in object_ids if rnd.random() >= orphans
+        for site_id in rnd.sample(site_ids, rnd.randint(1, min(max_object_sites, len(site_ids))))])
+
+    sizes = dict(sites=sites, users=users, groups=groups,
+                 permissions=permissions, objects=objects)
+    return Dataset(sizes, staff_user_ids, superuser_id, object_ids)
+
+
+def clear_dataset():
+    for model in (TestModel, GlobalPagePermission, Group, User, Site):
+        model.objects.all().delete()
+
+
+def decorated_admin(**options):
+    @restricted_overrides(**options)
+    class BenchmarkModelAdmin(ModelAdmin):
+        pass
+    return BenchmarkModelAdmin(TestModel, AdminSite())
+
+
+def request_factory(user):
+    """Returns a callable building a fresh ``method`` request for ``user``,
+    so nothing memoized on a request leaks from one timed call to the next.
+    """
+    factory = RequestFactory()
+
+    def new_request(method='get', data=None):
+        request = getattr(factory, method)('/', data or {})
+        request.user = user
+        return request
+    return new_request
+
+
+def scenarios(dataset, selection_size=500):
+    """Returns ``(name, prepare, call)`` triples.  ``prepare`` takes a request
+    factory and returns the request of one call, with its POST data already
+    parsed; ``call`` takes an admin and that request and is the timed part.
+    """
+    sites_field = TestModel._meta.get_field('sites')
+    # pbs provided objects are visible to every staff user
+    obj = (TestModel.objects.filter(pbs_provided=True).order_by('pk')[:1] or
+           TestModel.objects.order_by('pk')[:1])[0]
+    selection = dataset.object_ids[:selection_size]
+
+    def get(new_request):
+        return new_request()
+
+    def post_selection(new_request):
+        request = new_request('post', {'_selected_action': selection})
+        request.POST
+        return request
+
+    def queryset(admin, request):
+        qs = admin.queryset(request)
+        qs.count()
+        list(qs[:100])
+
+    def formfield_for_manytomany(admin, request):
+        list(admin.formfield_for_manytomany(sites_field, request).queryset)
+
+    def get_readonly_fields(admin, request):
+        admin.get_readonly_fields(request, obj)
+
+    def has_delete_permission(admin, request):
+        admin.has_delete_permission(request)
+
+    def change_view(admin, request):
+        admin.change_view(request, str(obj.pk))
+
+    return [('queryset', get, queryset),
+            ('formfield_for_manytomany', get, formfield_for_manytomany),
+            ('get_readonly_fields', get, get_readonly_fields),
+            ('has_delete_permission', post_selection, has_delete_permission),
+            ('change_view', get, change_view)]
+
+
+def measure(prepare, call, repeat):
+    """Returns the wall times in milliseconds of ``repeat`` calls of ``call``
+    with the argument ``prepare()`` returns, built outside the timing, and
+    the number of queries issued by the first call.
+    """
+    connection.use_debug_cursor = True
+    try:
+        timings = []
+        for i in range(repeat):
+            argument = prepare()
+            reset_queries()
+            start = time.time()
+            call(argument)
+            timings.append((time.time() - start) * 1000)
+            if i == 0:
+                queries = len(connection.queries)
+        return timings, queries
+    finally:
+        connection.use_debug_cursor = None
+        reset_queries()
+
+
+def run_benchmarks(dataset, repeat=5, strategies=QUERYSET_STRATEGIES,
+                   user_id=None):
+    """Times every scenario for a staff user, once per queryset strategy."""
+    user = User.objects.get(pk=user_id or dataset.staff_user_ids[0])
+    results = []
+    for strategy in strategies:
+        admin = decorated_admin(restrict_user=True, strategy=strategy)
+        new_request = request_factory(user)
+        for name, prepare, scenario in scenarios(dataset):
+            timings, queries = measure(
+                lambda: prepare(new_request),
+                lambda request: scenario(admin, request), repeat)
+            timings.sort()
+            results.append({
+                'scenario': name,
+                'strategy': strategy,
+                'sizes': dataset.sizes,
+                'repeat': repeat,
+                'queries': queries,
+                'min_ms': round(timings[0], 3),
+                'median_ms': round(timings[len(timings) // 2], 3),
+                'max_ms': round(timings[-1], 3),
+            })
+    return results
@@ -0,0 +1,193 @@
+"""
+Concurrent load test of the restricted admin views.
+
+``run_load`` logs staff and superuser sessions of Django's test client in to
+the admin of ``urls_test`` and drives them from a thread pool against the
+changelist, change form and delete-selected views of TestModel.  It
+returns the throughput and latency percentiles of every view, for the
+decorated and the plain admin on the same data.
+"""
+import math
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+from django.contrib import admin
+from django.contrib.admin.options import ModelAdmin
+from django.contrib.auth.models import User, Permission
+from django.core.urlresolvers import reverse, clear_url_caches
+from django.db import connection
+from django.test.client import Client
+from restricted_model_admin.decorators import restricted_overrides
+from restricted_model_admin.test_model import TestModel
+
+
+PASSWORD = 'loadtest'
+DECORATED = 'decorated'
+UNDECORATED = 'undecorated'
+MODES = (DECORATED, UNDECORATED)
+PERCENTILES = (50, 95, 99)
+
+
+def admin_class(mode, **options):
+    """Returns the TestModel admin of ``mode``: restricted by the overrides
+    with ``options`` or a plain ModelAdmin.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown admin mode %r, expected one of %s' %
+                         (mode, ', '.join(MODES)))
+
+    class LoadTestModelAdmin(ModelAdmin):
+        pass
+
+    if mode == DECORATED:
+        options.setdefault('restrict_user', True)
+        return restricted_overrides(**options)(LoadTestModelAdmin)
+    return LoadTestModelAdmin
+
+
+def register_admin(admin_class):
+    """Serves TestModel through ``admin_class`` on the admin site of
+    ``urls_test``.
+    """
+    if TestModel in admin.site._registry:
+        admin.site.unregister(TestModel)
+    admin.site.register(TestModel, admin_class)
+    # urls_test builds the admin patterns when it is imported
+    if 'urls_test' in sys.modules:
+        reload(sys.modules['urls_test'])
+    clear_url_caches()
+
+
+def session_users(dataset, sessions, superuser_ratio=0.2):
+    """Returns the usernames of ``sessions`` sessions, ``superuser_ratio`` of
+    them superuser sessions, and gives the users a password and the delete
+    permission.
+    """
+    superusers = int(round(sessions * superuser_ratio))
+    staff_ids = [dataset.staff_user_ids[i % len(dataset.staff_user_ids)]
+                 for i in range(sessions - superusers)]
+    users = User.objects.in_bulk(set(staff_ids) | set([dataset.superuser_id]))
+    delete_permission = Permission.objects.get(codename='delete_testmodel')
+    for user in users.values():
+        user.set_password(PASSWORD)
+        user.save()
+        if not user.is_superuser:
+            user.user_permissions.add(delete_permission)
+    return ([users[dataset.superuser_id].username] * superusers +
+            [users[pk].username for pk in staff_ids])
+
+
+def login(username):
+    client = Client()
+    if not client.login(username=username, password=PASSWORD):
+        raise ValueError('Could not log %s in' % username)
+    return client
+
+
+def views(dataset, selection_size=50):
+    """Returns ``(name, callable)`` pairs; each callable takes a logged in
+    client and returns the response of one request.
+
+    The delete-selected flow stops at the confirmation page, so every
+    request sees the same data.
+    """
+    # pbs provided objects are visible to every staff user
+    obj = (TestModel.objects.filter(pbs_provided=True).order_by('pk')[:1] or
+           TestModel.objects.order_by('pk')[:1])[0]
+    selection = list(TestModel.objects.filter(pbs_provided=False, read_only=False)
+                     .order_by('pk').values_list('pk', flat=True)[:selection_size])
+    changelist_url = reverse('admin:restricted_model_admin_testmodel_changelist')
+    change_url = reverse('admin:restricted_model_admin_testmodel_change',
+                         args=(obj.pk, ))
+
+    def changelist(client):
+        return client.get(changelist_url)
+
+    def change_form(client):
+        return client.get(change_url)
+
+    def delete_selected(client):
+        return client.post(changelist_url, {'action': 'delete_selected',
+                                            '_selected_action': selection})
+
+    return [('changelist', changelist),
+            ('change_form', change_form),
+            ('delete_selected', delete_selected)]
+
+
+def percentile(timings, p):
+    """Nearest rank ``p`` percentile of the sorted ``timings``."""
+    rank = max(int(math.ceil(p / 100.0 * len(timings))) - 1, 0)
+    return timings[rank]
+
+
+def run_session(client, view, requests):
+    """Performs ``requests`` requests of ``view`` with ``client`` and returns
+    their ``(milliseconds, status code)``.
+    """
+    calls = []
+    try:
+        for i in range(requests):
+            start = time.time()
+            response = view(client)
+            calls.append(((time.time() - start) * 1000, response.status_code))
+    finally:
+        # every thread has its own database connection
+        connection.close()
+    return calls
+
+
+def run_view(clients, view, requests, threads):
+    """Runs ``requests`` requests of ``view`` in every session of ``clients``
+    on ``threads`` threads and returns the throughput and latencies.
+    """
+    pool = ThreadPool(threads)
+    try:
+        start = time.time()
+        sessions = pool.map(lambda client: run_session(client, view, requests),
+                            clients)
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    calls = [call for session in sessions for call in session]
+    timings = sorted(ms for ms, status in calls)
+    statuses = {}
+    for ms, status in calls:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    result = {
+        'requests': len(calls),
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(calls) / elapsed, 3) if elapsed else None,
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3),
+    }
+    for p in PERCENTILES:
+        result['p%d_ms' % p] = round(percentile(timings, p), 3)
+    return result
+
+
+def run_load(dataset, sessions=20, threads=8, requests=10, superuser_ratio=0.2,
+             modes=MODES, **options):
+    """Load tests every view with ``sessions`` concurrent sessions, once per
+    admin mode; ``options`` configure the decorated admin.
+    """
+    usernames = session_users(dataset, sessions, superuser_ratio)
+    superusers = usernames.count(User.objects.get(pk=dataset.superuser_id).username)
+    results = []
+    for mode in modes:
+        register_admin(admin_class(mode, **options))
+        clients = [login(username) for username in usernames]
+        for name, view in views(dataset):
+            result = run_view(clients, view, requests, threads)
+            result.update({
+                'view': name,
+                'mode': mode,
+                'sizes': dataset.sizes,
+                'sessions': sessions,
+                'superuser_sessions': superusers,
+                'threads': threads,
+            })
+            results.append(result)
+    return results
@@ -0,0 +1,49 @@
+from django.contrib.admin.util import model_ngettext
+from django.core.exceptions import PermissionDenied
+from django.utils.translation import ugettext_lazy as _
+
+
+def flag_action(field, value, description, message):
+    """Builds a changelist action setting ``field`` to ``value`` on the
+    objects it is run for, with a single UPDATE whatever their number.
+
+    The action gets the changelist queryset, so only rows of the restricted
+    queryset (and of a "select all" selection) are touched.
+    """
+    def action(modeladmin, request, queryset):
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        count = queryset.update(**{field: value})
+        modeladmin.message_user(request, message % {
+            'count': count, 'items': model_ngettext(modeladmin.opts, count)})
+    action.__name__ = '%s_%s' % ('mark' if value else 'unmark', field)
+    action.short_description = description
+    return action
+
+
+mark_pbs_provided = flag_action(
+    'pbs_provided', True,
+    _('Mark selected %(verbose_name_plural)s as PBS provided'),
+    _('%(count)d %(items)s marked as PBS provided.'))
+unmark_pbs_provided = flag_action(
+    'pbs_provided', False,
+    _('Unmark selected %(verbose_name_plural)s as PBS provided'),
+    _('%(count)d %(items)s no longer marked as PBS provided.'))
+mark_read_only = flag_action(
+    'read_only', True,
+    _('Mark selected %(verbose_name_plural)s as read only'),
+    _('%(count)d %(items)s marked as read only.'))
+unmark_read_only = flag_action(
+    'read_only', False,
+    _('Unmark selected %(verbose_name_plural)s as read only'),
+    _('%(count)d %(items)s no longer marked as read only.'))
+
+
+def available_flag_actions(policy):
+    """Returns the flag actions that apply to the fields of ``policy.model``."""
+    actions = []
+    if policy.has_pbs_provided:
+        actions += [mark_pbs_provided, unmark_pbs_provided]
+    if policy.has_read_only:
+        actions += [mark_read_only, unmark_read_only]
+    return actions
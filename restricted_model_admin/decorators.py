@@ -1,17 +1,59 @@
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.db.models import Q, Model
-from django.contrib.admin.options import ModelAdmin
+from django.db.models.query import QuerySet
+from django.contrib.admin.options import ModelAdmin, InlineModelAdmin
+from django.contrib.admin.views.main import IS_POPUP_VAR
+from django.core.exceptions import ValidationError, PermissionDenied
+from django.core.urlresolvers import reverse_lazy
+from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
+from permissions import (get_allowed_site_lookup, get_allowed_site_ids,
+                         request_cache, read_database)
+from views import sites_autocomplete_response
+from paginator import COUNT_MODES, RestrictedPaginator, restricted_changelist
+from widgets import SitesAutocompleteWidget, LockedWidget
+from fields import PermittedSitesField
+from selection import (is_select_across, action_queryset,
+                       selected_pk_chunks, remember_action_queryset)
+from policy import (restriction_policy, JOIN_STRATEGY, SUBQUERY_STRATEGY,
+                    QUERYSET_STRATEGIES)
+from instrumentation import instrument_overrides
+from actions import available_flag_actions
+from export import export_csv, export_json_lines
+from prefetch import prefetch_sites
+from query import restrict_queryset
 
 
 def restricted_overrides(restrict_user=False, include_orphan=True, allways_ro=(), **kw):
+    # every override gets the full option set so they all share one policy
+    options = dict(kw, restrict_user=restrict_user,
+                   include_orphan=include_orphan, allways_ro=allways_ro)
 
     def _restricted_decorators(cls):
-        cls = restricted__formfield_for_manytomany__override(restrict_user)(cls)
-        cls = restricted__queryset__override(restrict_user, include_orphan)(cls)
-        cls = restricted__get_readonly_fields__override(restrict_user, allways_ro)(cls)
-        cls = restricted__has_delete_permission__override(restrict_user)(cls)
-        cls = restricted__change_view__override(restrict_user)(cls)
+        cls = restricted__formfield_for_manytomany__override(**options)(cls)
+        cls = restricted__queryset__override(**options)(cls)
+        cls = restricted__get_readonly_fields__override(**options)(cls)
+        cls = restricted__has_delete_permission__override(**options)(cls)
+        cls = restricted__change_view__override(**options)(cls)
+        cls = restricted__actions__override(**options)(cls)
+        return cls
+
+    return _restricted_decorators
+
+
+def restricted_inline_overrides(restrict_user=False, allways_ro=(), **kw):
+    """``restricted_overrides`` for InlineModelAdmin derived classes: the
+    sites field, read only fields and delete permission of the inline follow
+    the restrictions of the user and the read only state of the parent
+    object.
+    """
+    options = dict(kw, restrict_user=restrict_user, allways_ro=allways_ro)
+
+    def _restricted_decorators(cls):
+        cls = restricted__formfield_for_manytomany__override(**options)(cls)
+        cls = restricted__get_readonly_fields__override(**options)(cls)
+        cls = restricted__has_delete_permission__override(**options)(cls)
         return cls
 
     return _restricted_decorators
@@ -46,48 +88,229 @@ def throw_error_if_not_ModelAdmin(f):
     return _inner
 
 
-def restricted__formfield_for_manytomany__override(restrict_user=False, **kw):
+def throw_error_if_not_admin(f):
+    def _inner(*args, **kwargs):
+        cls = args[0]
+        if not issubclass(cls, (ModelAdmin, InlineModelAdmin)):
+            raise TypeError('%s should be an subclass of ModelAdmin or '
+                            'InlineModelAdmin' % cls.__name__)
+        return f(*args, **kwargs)
+    return _inner
+
+
+def restricted__formfield_for_manytomany__override(restrict_user=False, sites_autocomplete=False, **kw):
     """Parameterized class decorator used to extend the default "formfield_for_manytomany" behavior of a ModelAdmin derived class.
+
+    With ``sites_autocomplete`` the sites field only renders the selected
+    sites and searches the permitted ones through a paginated JSON view
+    registered next to the admin's own urls.
+
+    With ``read_database`` (or the RESTRICTED_MODEL_ADMIN_READ_DATABASE
+    setting) the site choices and the autocomplete results are read from
+    that database.  When a form is submitted, the permitted site ids the
+    sites are checked against and the selected sites are both read from the
+    primary.
+
+    Inlines share the permitted sites loaded for the parent form, so every
+    sites field of a page costs one query; ``sites_autocomplete`` needs the
+    urls of a ModelAdmin and is not available on them.
     """
-    @throw_error_if_not_ModelAdmin
+    options = dict(kw, restrict_user=restrict_user,
+                   sites_autocomplete=sites_autocomplete)
+
+    @throw_error_if_not_admin
     def _formfield_for_manytomany(cls):
+        if issubclass(cls, InlineModelAdmin) and sites_autocomplete:
+            raise TypeError('sites_autocomplete is not available on the '
+                            'inline %s' % cls.__name__)
 
         def __formfield_for_manytomany(self, db_field, request, **kwargs):
             if db_field.name == "sites":
-                f = Q()
-                if restrict_user and not request.user.is_superuser:
-                    f |= Q(globalpagepermission__user=request.user)
-                    f |= Q(globalpagepermission__group__user=request.user)
-                kwargs["queryset"] = Site.objects.filter(f).distinct()
+                policy = restriction_policy(self.model, **options)
+                kwargs["queryset"] = permitted_sites(policy, request)
+                kwargs["form_class"] = PermittedSitesField
+                kwargs["read_database"] = read_database(policy.read_database)
+                kwargs["site_cache"] = permitted_sites_cache(policy, request)
+                kwargs["allowed_site_ids"] = permitted_site_ids(policy, request)
+                if policy.sites_autocomplete:
+                    kwargs["widget"] = SitesAutocompleteWidget(reverse_lazy(
+                        'admin:%s' % sites_autocomplete_url_name(self),
+                        current_app=self.admin_site.name))
             return (super(cls, self)
                     .formfield_for_manytomany(db_field, request, **kwargs))
 
+        def __get_urls(self):
+            urls = super(cls, self).get_urls()
+            if not restriction_policy(self.model, **options).sites_autocomplete:
+                return urls
+            from django.conf.urls import patterns, url
+            view = self.admin_site.admin_view(self.sites_autocomplete_view)
+            return patterns('',
+                url(r'^sites-autocomplete/$', view,
+                    name=sites_autocomplete_url_name(self)),
+            ) + urls
+
+        def __sites_autocomplete_view(self, request):
+            if not (self.has_add_permission(request) or
+                    self.has_change_permission(request)):
+                raise PermissionDenied
+            policy = restriction_policy(self.model, **options)
+            sites = permitted_sites(policy, request)
+            alias = read_database(policy.read_database)
+            if alias:
+                sites = sites.using(alias)
+            return sites_autocomplete_response(request, sites)
+
         cls.formfield_for_manytomany = __formfield_for_manytomany
+        if issubclass(cls, InlineModelAdmin):
+            instrument_overrides(cls, 'formfield_for_manytomany', options,
+                                 ('formfield_for_manytomany', ))
+            return cls
+        cls.get_urls = __get_urls
+        cls.sites_autocomplete_view = __sites_autocomplete_view
+        instrument_overrides(cls, 'formfield_for_manytomany', options,
+                             ('formfield_for_manytomany', 'sites_autocomplete_view'))
         return cls
     return _formfield_for_manytomany
 
 
-def restricted__queryset__override(restrict_user=False, include_orphan=True, **kw):
+def permitted_sites(policy, request):
+    """Returns the sites ``request.user`` may attach objects to."""
+    sites = Site.objects.all()
+    if policy.restrict_user and not request.user.is_superuser:
+        sites = sites.filter(pk__in=get_allowed_site_lookup(
+            request, policy.read_database))
+    return sites
+
+
+def permitted_site_ids(policy, request):
+    """Returns the SitePermissionSet of the sites ``request.user`` may attach
+    objects to, or None when the user is not restricted.  Submitting
+    requests read it from the primary, see ``permission_database``.
+    """
+    if policy.restrict_user and not request.user.is_superuser:
+        return get_allowed_site_ids(request, policy.read_database)
+    return None
+
+
+def permitted_sites_cache(policy, request):
+    """Returns the dictionary the sites field of ``request`` keeps the
+    permitted sites in, shared by the forms built during the request.
+    """
+    restricted = bool(policy.restrict_user and not request.user.is_superuser)
+    return request_cache(request).setdefault(('permitted_sites', restricted), {})
+
+
+def sites_autocomplete_url_name(model_admin):
+    opts = model_admin.model._meta
+    return '%s_%s_sites_autocomplete' % (opts.app_label, opts.module_name)
+
+
+def restricted__queryset__override(restrict_user=False, include_orphan=True,
+                                   strategy=JOIN_STRATEGY, count_mode=None,
+                                   count_cap=1000, annotate_read_only=False,
+                                   shared_and_readonly=True, **kw):
     """Parameterized class decorator used to extend the default "queryset" behavior of a ModelAdmin derived class.
+
+    ``strategy`` selects how the restriction is expressed in SQL:
+    ``'join'`` ORs the conditions over the sites/permission joins and
+    de-duplicates the result with DISTINCT, while ``'subquery'`` returns the
+    same rows through ``pk__in`` subqueries on the sites M2M table and needs
+    no DISTINCT on the outer query.
+
+    ``count_mode`` selects how the changelist counts the restricted rows:
+    exactly (None), through Django's cache (``'cached'``) or up to
+    ``count_cap`` rows, past which it reports "more than count_cap"
+    (``'capped'``).
+
+    With ``annotate_read_only`` every row carries an ``is_read_only`` value
+    computed in SQL, shown by the ``is_read_only`` list_display column; the
+    ReadOnlyListFilter list_filter filters on the same condition.
+
+    With ``prefetch_sites`` the changelist fetches the sites of its rows in
+    one query, keeping only the sites the user may see when
+    ``restrict_user`` is set.
+
+    With ``read_database`` (or the RESTRICTED_MODEL_ADMIN_READ_DATABASE
+    setting) the changelist counts and rows are read from that database,
+    unless the changelist is editable, and so are the sites of the user on
+    GET requests; requests that may write resolve them on the primary.
+    ``queryset`` itself stays on the primary, so objects under edit, actions
+    and deletions are unaffected.
     """
+    if strategy not in QUERYSET_STRATEGIES:
+        raise ValueError('Unknown queryset strategy %r, expected one of %s' %
+                         (strategy, ', '.join(QUERYSET_STRATEGIES)))
+    if count_mode not in COUNT_MODES:
+        raise ValueError('Unknown count mode %r, expected one of %s' %
+                         (count_mode, ', '.join(map(repr, COUNT_MODES))))
+    options = dict(kw, restrict_user=restrict_user,
+                   include_orphan=include_orphan, strategy=strategy,
+                   count_mode=count_mode, count_cap=count_cap,
+                   annotate_read_only=annotate_read_only,
+                   shared_and_readonly=shared_and_readonly)
+
     @throw_error_if_not_ModelAdmin
     def _queryset(cls):
 
         def __queryset(self, request):
+            policy = restriction_policy(self.model, **options)
             q = super(cls, self).queryset(request)
-            f = Q()
-            if not request.user.is_superuser:
-                if restrict_user:
-                    f |= Q(sites__globalpagepermission__user=request.user)
-                    f |= Q(sites__globalpagepermission__group__user=request.user)
-                if 'pbs_provided' in self.model._meta.get_all_field_names():
-                    f |= Q(pbs_provided=True)
-
-                if include_orphan:
-                    f |= Q(sites__isnull=True)
-            return q.filter(f).distinct()
+            site_ids = None
+            if policy.restrict_user and not request.user.is_superuser:
+                site_ids = get_allowed_site_lookup(request, policy.read_database)
+            q = restrict_queryset(q, policy, request.user, site_ids)
+            if policy.annotate_read_only:
+                sql, params = ro_state_sql(policy)
+                q = q.extra(select={'is_read_only': sql}, select_params=params)
+            return q
+
+        def __get_paginator(self, request, queryset, per_page, orphans=0,
+                            allow_empty_first_page=True):
+            policy = restriction_policy(self.model, **options)
+            return RestrictedPaginator(queryset, per_page, orphans,
+                                       allow_empty_first_page,
+                                       count_mode=policy.count_mode,
+                                       count_cap=policy.count_cap)
+
+        def __get_changelist(self, request, **kwargs):
+            return restricted_changelist(
+                super(cls, self).get_changelist(request, **kwargs))
+
+        def __is_read_only(self, obj):
+            if hasattr(obj, 'is_read_only'):
+                return bool(obj.is_read_only)
+            policy = restriction_policy(self.model, **options)
+            return ro_state(obj, policy.shared_and_readonly)
+        __is_read_only.boolean = True
+        __is_read_only.short_description = _('locked')
+        if annotate_read_only:
+            __is_read_only.admin_order_field = 'is_read_only'
+
+        def __read_only_filter(self):
+            return ro_state_filter(restriction_policy(self.model, **options))
+
+        def __get_read_database(self, request):
+            return read_database(restriction_policy(self.model, **options).read_database)
+
+        def __prefetch_changelist_sites(self, request, queryset):
+            policy = restriction_policy(self.model, **options)
+            if not (policy.prefetch_sites and policy.has_sites):
+                return queryset
+            site_ids = None
+            if policy.restrict_user and not request.user.is_superuser:
+                site_ids = get_allowed_site_lookup(request, policy.read_database)
+            return prefetch_sites(queryset, site_ids)
 
         cls.queryset = __queryset
+        cls.get_paginator = __get_paginator
+        cls.get_changelist = __get_changelist
+        cls.is_read_only = __is_read_only
+        cls.read_only_filter = __read_only_filter
+        cls.prefetch_changelist_sites = __prefetch_changelist_sites
+        cls.get_read_database = __get_read_database
+        instrument_overrides(cls, 'queryset', options,
+                             ('queryset', 'get_paginator', 'get_changelist'))
         return cls
 
     return _queryset
@@ -95,21 +318,71 @@ def restricted__queryset__override(restrict_user=False, include_orphan=True, **k
 
 def restricted__get_readonly_fields__override(restrict_user=False, allways_ro=(), shared_and_readonly=True,**kw):
     """Parameterized class decorator used to extend the default "get_readonly_fields" behavior of a ModelAdmin derived class.
+
+    The ``list_editable`` changelist forms of read only rows are locked too:
+    their fields render read only and their changes are never saved.  The
+    rows of a page are decided together by ``get_ro_states``.
+
+    On an InlineModelAdmin every field of the inline is read only when the
+    parent object is, as decided by ``parent_ro_state``.
     """
-    @throw_error_if_not_ModelAdmin
+    options = dict(kw, restrict_user=restrict_user, allways_ro=allways_ro,
+                   shared_and_readonly=shared_and_readonly)
+
+    @throw_error_if_not_admin
     def _get_readonly_fields(cls):
+        if issubclass(cls, InlineModelAdmin):
+            return _inline_get_readonly_fields(cls)
 
         def __get_readonly_fields(self, request, obj=None):
+            policy = restriction_policy(self.model, **options)
             if request.user.is_superuser:
-                return allways_ro
+                return list(policy.allways_ro)
             if not obj:
-                return  self.model().get_readonly_fields_for_stuff_users()
-            if restrict_user and ro_state(obj, shared_and_readonly):
+                return list(policy.staff_readonly_fields)
+            if policy.restrict_user and object_ro_state(policy, request, obj):
                 # return all fields
-                return obj._meta.get_all_field_names()
-            return obj.get_readonly_fields_for_stuff_users()
+                return list(policy.all_field_names)
+            return list(policy.staff_readonly_fields)
+
+        def __get_ro_states(self, request, objects):
+            policy = restriction_policy(self.model, **options)
+            return request_ro_states(policy, request, objects)
+
+        def __get_object_ro_state(self, request, obj):
+            policy = restriction_policy(self.model, **options)
+            return object_ro_state(policy, request, obj)
+
+        def __get_changelist_formset(self, request, **kwargs):
+            formset = super(cls, self).get_changelist_formset(request, **kwargs)
+            policy = restriction_policy(self.model, **options)
+            if request.user.is_superuser or not policy.restrict_user:
+                return formset
+            return locked_rows_formset(formset, self, request)
+
+        cls.get_readonly_fields = __get_readonly_fields
+        cls.get_ro_states = __get_ro_states
+        cls.get_object_ro_state = __get_object_ro_state
+        cls.get_changelist_formset = __get_changelist_formset
+        instrument_overrides(cls, 'get_readonly_fields', options,
+                             ('get_readonly_fields', 'get_ro_states',
+                              'get_object_ro_state', 'get_changelist_formset'))
+        return cls
+
+    def _inline_get_readonly_fields(cls):
+
+        def __get_readonly_fields(self, request, obj=None):
+            policy = restriction_policy(self.model, **options)
+            if request.user.is_superuser:
+                return list(policy.allways_ro)
+            if (obj and policy.restrict_user and
+                    parent_ro_state(self, request, obj, options)):
+                return list(policy.all_field_names)
+            return list(policy.staff_readonly_fields)
 
         cls.get_readonly_fields = __get_readonly_fields
+        instrument_overrides(cls, 'get_readonly_fields', options,
+                             ('get_readonly_fields', ))
         return cls
 
     return _get_readonly_fields
@@ -117,23 +390,56 @@ def restricted__get_readonly_fields__override(restrict_user=False, allways_ro=()
 
 def restricted__has_delete_permission__override(restrict_user=False, shared_and_readonly=True, **kw):
     """Parameterized class decorator used to extend the default "has_delete_permission" behavior of a ModelAdmin derived class.
+
+    On an InlineModelAdmin the rows of the inline cannot be deleted while
+    the parent object is read only.
     """
-    @throw_error_if_not_ModelAdmin
+    options = dict(kw, restrict_user=restrict_user,
+                   shared_and_readonly=shared_and_readonly)
+
+    @throw_error_if_not_admin
     def _has_delete_permission(cls):
+        if issubclass(cls, InlineModelAdmin):
+            return _inline_has_delete_permission(cls)
 
         def __has_delete_permission(self, request, obj=None):
             if request.user.is_superuser:
                 return True
-            if restrict_user:
+            policy = restriction_policy(self.model, **options)
+            if policy.restrict_user:
                 if not obj:
                     #here multiple objects have been selected for deletion
-                    objs = get_objects_to_bo_deleted(self.model, request)
-                    return not any([ro_state(o, shared_and_readonly) for o in objs])
-                if ro_state(obj, shared_and_readonly):
+                    return not selection_has_read_only(policy, self, request)
+                if object_ro_state(policy, request, obj):
                     return False
             return True
 
+        def __response_action(self, request, queryset):
+            # keeps the filtered changelist queryset around so a "select all"
+            # deletion is checked against exactly the rows it applies to
+            remember_action_queryset(request, self.model, queryset)
+            return super(cls, self).response_action(request, queryset)
+
+        cls.has_delete_permission = __has_delete_permission
+        cls.response_action = __response_action
+        instrument_overrides(cls, 'has_delete_permission', options,
+                             ('has_delete_permission', 'response_action'))
+        return cls
+
+    def _inline_has_delete_permission(cls):
+
+        def __has_delete_permission(self, request, obj=None):
+            if request.user.is_superuser:
+                return True
+            policy = restriction_policy(self.model, **options)
+            if (obj and policy.restrict_user and
+                    parent_ro_state(self, request, obj, options)):
+                return False
+            return super(cls, self).has_delete_permission(request, obj)
+
         cls.has_delete_permission = __has_delete_permission
+        instrument_overrides(cls, 'has_delete_permission', options,
+                             ('has_delete_permission', ))
         return cls
     return _has_delete_permission
 
@@ -141,23 +447,72 @@ def restricted__has_delete_permission__override(restrict_user=False, shared_and_
 def restricted__change_view__override(restrict_user=False, shared_and_readonly=True, **kw):
     """Parameterized class decorator used to exted the default "change_view" behavior of a ModelAdmin derived class.
     """
+    options = dict(kw, restrict_user=restrict_user,
+                   shared_and_readonly=shared_and_readonly)
+
     @throw_error_if_not_ModelAdmin
     def _change_view(cls):
 
         def __change_view(self, request, object_id, extra_context=None):
             extra_context = {}
             if not request.user.is_superuser:
-                obj = self.model.objects.get(pk=object_id)
-                if restrict_user and ro_state(obj, shared_and_readonly):
+                policy = restriction_policy(self.model, **options)
+                if policy.restrict_user and stored_ro_state(policy, request, object_id):
                     extra_context = {'read_only': True}
             return super(cls, self).change_view(request,
                         object_id, extra_context=extra_context)
 
+        def __get_object(self, request, object_id):
+            # the object under edit is fetched once per request
+            memo = request_cache(request)
+            key = ('object', self.model, force_unicode(object_id))
+            if key not in memo:
+                memo[key] = super(cls, self).get_object(request, object_id)
+            return memo[key]
+
         cls.change_view = __change_view
+        cls.get_object = __get_object
+        instrument_overrides(cls, 'change_view', options,
+                             ('change_view', 'get_object'))
         return cls
     return _change_view
 
 
+def restricted__actions__override(flag_actions=True, export_actions=False, **kw):
+    """Parameterized class decorator used to extend the default "get_actions" behavior of a ModelAdmin derived class.
+
+    With ``flag_actions`` superusers are offered actions marking and
+    unmarking the selected objects as PBS provided or read only.  With
+    ``export_actions`` every user is offered actions streaming the selected
+    objects as CSV or JSON lines; the admin's ``export_fields`` selects the
+    exported fields.
+    """
+    options = dict(kw, flag_actions=flag_actions, export_actions=export_actions)
+
+    @throw_error_if_not_ModelAdmin
+    def _actions(cls):
+
+        def __get_actions(self, request):
+            actions = super(cls, self).get_actions(request)
+            if self.actions is None or IS_POPUP_VAR in request.GET:
+                return actions
+            policy = restriction_policy(self.model, **options)
+            added = []
+            if policy.export_actions:
+                added += [export_csv, export_json_lines]
+            if policy.flag_actions and request.user.is_superuser:
+                added += available_flag_actions(policy)
+            for action in added:
+                name = action.__name__
+                actions[name] = (action, name, action.short_description)
+            return actions
+
+        cls.get_actions = __get_actions
+        instrument_overrides(cls, 'actions', options, ('get_actions', ))
+        return cls
+    return _actions
+
+
 def ro_state(obj, shared_and_readonly):
     #checks to determine if the state of the obj should be readonly
     read_only = getattr(obj, "read_only", False)
@@ -165,5 +520,180 @@ def ro_state(obj, shared_and_readonly):
     return read_only or (pbs_provided and shared_and_readonly)
 
 
-def get_objects_to_bo_deleted(model, request):
-    return model.objects.filter(id__in=request.POST.getlist('_selected_action', []))
\ No newline at end of file
+def ro_states(model, objects, shared_and_readonly=True):
+    """Batch counterpart of ``ro_state``: returns ``{pk: read_only}`` for
+    ``objects``, a queryset of ``model`` or a list of primary keys or of
+    instances.
+
+    Querysets and primary keys are decided with one query limited to the
+    primary key and flag columns; instances and already evaluated querysets
+    need no query.
+    """
+    policy = restriction_policy(model, shared_and_readonly=shared_and_readonly)
+    return policy_ro_states(policy, objects)
+
+
+def policy_ro_states(policy, objects):
+    if isinstance(objects, QuerySet) and objects._result_cache is not None:
+        objects = objects._result_cache
+    if not isinstance(objects, QuerySet):
+        objects = list(objects)
+        if not objects:
+            return {}
+        if all(isinstance(obj, Model) for obj in objects):
+            return dict((obj.pk, ro_state(obj, policy.shared_and_readonly))
+                        for obj in objects)
+        objects = policy.model._default_manager.filter(pk__in=objects)
+    flags = []
+    if policy.has_read_only:
+        flags.append('read_only')
+    if policy.has_pbs_provided and policy.shared_and_readonly:
+        flags.append('pbs_provided')
+    return dict((row[0], any(row[1:]))
+                for row in objects.values_list('pk', *flags))
+
+
+def request_ro_states(policy, request, objects):
+    """``policy_ro_states`` shared with ``object_ro_state`` and
+    ``stored_ro_state`` for the rest of the request.
+    """
+    states = policy_ro_states(policy, objects)
+    memo = request_cache(request)
+    for pk, state in states.items():
+        memo[_ro_state_key(policy, pk)] = state
+    return states
+
+
+def locked_rows_formset(formset, model_admin, request):
+    """Returns a subclass of the changelist ``formset`` locking the forms of
+    the read only rows, decided for the whole page with one query.
+
+    Locked forms render their values as text instead of inputs, and are
+    neither validated nor saved.
+    """
+    class LockedRowsFormSet(formset):
+
+        def locked_pks(self):
+            if not hasattr(self, '_locked_pks'):
+                states = model_admin.get_ro_states(request, self.get_queryset())
+                self._locked_pks = set(pk for pk, state in states.items() if state)
+            return self._locked_pks
+
+        def _construct_form(self, i, **kwargs):
+            form = super(LockedRowsFormSet, self)._construct_form(i, **kwargs)
+            if i < self.initial_form_count() and form.instance.pk in self.locked_pks():
+                lock_form(form, self.model._meta.pk.name)
+            return form
+
+    return LockedRowsFormSet
+
+
+def lock_form(form, pk_name):
+    """Replaces the inputs of ``form`` but the ``pk_name`` one by their values,
+    so nothing can be submitted for them.
+    """
+    for name, field in form.fields.items():
+        if name != pk_name:
+            field.widget = LockedWidget(field.widget,
+                                        form.initial.get(name, field.initial))
+    # an unchanged form allowed to be empty is not validated, and the admin
+    # only saves the changelist forms that changed
+    form.empty_permitted = True
+    form.has_changed = lambda: False
+
+
+def _ro_state_key(policy, pk):
+    return ('ro_state', policy.model, force_unicode(pk), policy.shared_and_readonly)
+
+
+def object_ro_state(policy, request, obj):
+    """``ro_state`` of ``obj``, decided once per request and object."""
+    if obj.pk is None:
+        return ro_state(obj, policy.shared_and_readonly)
+    memo = request_cache(request)
+    key = _ro_state_key(policy, obj.pk)
+    if key not in memo:
+        memo[key] = ro_state(obj, policy.shared_and_readonly)
+    return memo[key]
+
+
+def parent_ro_state(inline, request, obj, options):
+    """``ro_state`` of ``obj``, the parent object of the forms of ``inline``.
+
+    It is asked of the registered parent admin when it is restricted, so the
+    parent form and every inline of the page share its per request memo;
+    otherwise it is decided with ``options`` on the parent model.
+    """
+    registry = getattr(inline.admin_site, '_registry', {})
+    parent_admin = registry.get(inline.parent_model)
+    if hasattr(parent_admin, 'get_object_ro_state'):
+        return parent_admin.get_object_ro_state(request, obj)
+    return object_ro_state(restriction_policy(inline.parent_model, **options),
+                           request, obj)
+
+
+def stored_ro_state(policy, request, object_id):
+    """``ro_state`` of the object stored under ``object_id``, decided in the
+    database from its read only flags without loading the row, and shared
+    with ``object_ro_state`` for the rest of the request.
+    """
+    memo = request_cache(request)
+    key = _ro_state_key(policy, object_id)
+    if key not in memo:
+        locked = ro_state_filter(policy)
+        try:
+            memo[key] = locked is not None and (policy.model._default_manager
+                .filter(pk=object_id).filter(locked).exists())
+        except (ValueError, ValidationError):
+            # malformed ids are left to change_view, which answers with a 404
+            memo[key] = False
+    return memo[key]
+
+
+def ro_state_filter(policy):
+    """SQL counterpart of ``ro_state``: returns a Q matching the objects of
+    ``policy.model`` that are read only, or None if none of them can be.
+    """
+    f = Q()
+    if policy.has_read_only:
+        f |= Q(read_only=True)
+    if policy.has_pbs_provided and policy.shared_and_readonly:
+        f |= Q(pbs_provided=True)
+    return f or None
+
+
+def ro_state_sql(policy):
+    """SQL counterpart of ``ro_state`` as an expression over the columns of
+    ``policy.model``: returns the ``(sql, params)`` of a condition true for
+    the rows ``ro_state_filter`` matches.
+    """
+    qn = connection.ops.quote_name
+    table = qn(policy.model._meta.db_table)
+    columns = []
+    if policy.has_read_only:
+        columns.append(policy.model._meta.get_field('read_only').column)
+    if policy.has_pbs_provided and policy.shared_and_readonly:
+        columns.append(policy.model._meta.get_field('pbs_provided').column)
+    if not columns:
+        return '1 = 0', ()
+    sql = ' OR '.join('%s.%s = %%s' % (table, qn(column)) for column in columns)
+    return '(%s)' % sql, (True, ) * len(columns)
+
+
+def selection_has_read_only(policy, model_admin, request):
+    """Checks in the database whether any of the objects a changelist action
+    applies to is read only, without loading them.
+
+    A "select all" selection is checked with one query over the changelist
+    queryset, checked objects with one query per chunk of primary keys.
+    """
+    locked = ro_state_filter(policy)
+    if locked is None:
+        return False
+    if is_select_across(request):
+        return action_queryset(model_admin, request).filter(locked).exists()
+    manager = policy.model._default_manager
+    for pks in selected_pk_chunks(model_admin, request):
+        if manager.filter(pk__in=pks).filter(locked).exists():
+            return True
+    return False
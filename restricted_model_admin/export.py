@@ -0,0 +1,104 @@
+import csv
+import json
+from StringIO import StringIO
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.encoding import smart_str
+from django.utils.translation import ugettext_lazy as _
+from selection import queryset_value_chunks
+
+
+CSV_FORMAT = 'csv'
+JSON_LINES_FORMAT = 'jsonl'
+EXPORT_FORMATS = (CSV_FORMAT, JSON_LINES_FORMAT)
+CONTENT_TYPES = {
+    CSV_FORMAT: 'text/csv; charset=utf-8',
+    JSON_LINES_FORMAT: 'application/x-ndjson; charset=utf-8',
+}
+
+
+def export_fields(model_admin):
+    """Returns the ``export_fields`` of ``model_admin``, or the names of the
+    concrete fields of its model.
+    """
+    fields = getattr(model_admin, 'export_fields', None)
+    if fields is None:
+        fields = [f.name for f in model_admin.model._meta.fields]
+    return list(fields)
+
+
+def csv_lines(fields, chunks):
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow([smart_str(field) for field in fields])
+    yield out.getvalue()
+    for chunk in chunks:
+        out.seek(0)
+        out.truncate()
+        for row in chunk:
+            writer.writerow(['' if value is None else smart_str(value)
+                             for value in row])
+        yield out.getvalue()
+
+
+def json_lines(fields, chunks):
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+                      for row in chunk)
+
+
+def closing_connection(lines, using):
+    """Yields ``lines`` and closes the ``using`` connection once they are
+    exhausted or the response is closed.
+
+    Django closes the connection when the request finishes, before the
+    server iterates the body; the connection the chunk queries reopen would
+    otherwise stay open, idle in its transaction, until the next request.
+    A connection under transaction management is left alone.
+    """
+    try:
+        for line in lines:
+            yield line
+    finally:
+        connection = connections[using]
+        if not connection.is_managed():
+            connection.close()
+
+
+def export_response(queryset, fields, format, filename):
+    """Returns a response streaming ``fields`` of the rows of ``queryset`` as
+    CSV or JSON lines.
+
+    The body is an iterator: one chunk of rows is fetched and written at a
+    time, while the response is being sent, and the database connection
+    is closed after the last one.  Middleware reading ``response.content``
+    (GZip, ETags) defeats the streaming.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format %r, expected one of %s' %
+                         (format, ', '.join(EXPORT_FORMATS)))
+    chunks = queryset_value_chunks(queryset, fields)
+    lines = (csv_lines if format == CSV_FORMAT else json_lines)(fields, chunks)
+    response = HttpResponse(closing_connection(lines, queryset.db),
+                            content_type=CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, format)
+    return response
+
+
+def export_action(format, description):
+    """Builds a changelist action streaming the objects it is run for; it
+    gets the restricted changelist queryset, select-across included.
+    """
+    def action(modeladmin, request, queryset):
+        return export_response(queryset, export_fields(modeladmin), format,
+                               modeladmin.model._meta.module_name)
+    action.__name__ = 'export_%s' % format
+    action.short_description = description
+    return action
+
+
+export_csv = export_action(
+    CSV_FORMAT, _('Export selected %(verbose_name_plural)s as CSV'))
+export_json_lines = export_action(
+    JSON_LINES_FORMAT, _('Export selected %(verbose_name_plural)s as JSON lines'))
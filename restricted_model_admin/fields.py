@@ -0,0 +1,98 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+from django.utils.encoding import force_unicode
+
+
+class PermittedSitesChoiceIterator(ModelChoiceIterator):
+    """ModelChoiceIterator over the permitted sites the field loaded once,
+    read from the ``using`` database.
+    """
+
+    def __init__(self, field, using=None):
+        super(PermittedSitesChoiceIterator, self).__init__(field)
+        self.using = using
+        if using:
+            self.queryset = field.queryset.using(using)
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield (u"", self.field.empty_label)
+        for site in self.field.permitted_sites(self.using):
+            yield self.choice(site)
+
+    def __len__(self):
+        return len(self.field.permitted_sites(self.using))
+
+
+class PermittedSitesField(forms.ModelMultipleChoiceField):
+    """Sites field of the restricted admins.
+
+    The permitted sites of ``queryset`` are rendered as choices from
+    ``site_cache``, which the admin keeps for the whole request, so
+    rendering the form again after errors does not query them again.
+
+    Submitted sites are checked against ``allowed_site_ids``, the
+    SitePermissionSet of the user or None when the user is not restricted,
+    and only the selected sites are fetched, unless the choices were already
+    rendered from the same database.  With ``read_database`` the choices are
+    rendered from that database, while the selected sites are fetched from
+    the database of ``queryset`` so they can be related to objects saved on
+    the primary.
+    """
+
+    def __init__(self, queryset, read_database=None, site_cache=None,
+                 allowed_site_ids=None, *args, **kwargs):
+        self.read_database = read_database
+        self.site_cache = {} if site_cache is None else site_cache
+        self.allowed_site_ids = allowed_site_ids
+        super(PermittedSitesField, self).__init__(queryset, *args, **kwargs)
+
+    def permitted_sites(self, using=None):
+        """Returns the list of permitted sites read from ``using``, or from
+        the database of ``queryset``, querying it at most once.
+        """
+        key = using or self.queryset.db
+        if key not in self.site_cache:
+            queryset = self.queryset.using(using) if using else self.queryset
+            self.site_cache[key] = list(queryset)
+        return self.site_cache[key]
+
+    def _get_choices(self):
+        if hasattr(self, '_choices'):
+            return self._choices
+        return PermittedSitesChoiceIterator(self, self.read_database)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def selected_sites(self, pks):
+        """Returns ``{pk: site}`` for the permitted sites among ``pks``."""
+        if self.queryset.db in self.site_cache:
+            sites = self.site_cache[self.queryset.db]
+        else:
+            sites = self.queryset.filter(pk__in=pks)
+        return dict((site.pk, site) for site in sites)
+
+    def clean(self, value):
+        if self.required and not value:
+            raise ValidationError(self.error_messages['required'])
+        elif not self.required and not value:
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError(self.error_messages['list'])
+        pks = []
+        for pk in value:
+            try:
+                pk = int(force_unicode(pk).strip())
+            except ValueError:
+                raise ValidationError(self.error_messages['invalid_pk_value'] % pk)
+            if self.allowed_site_ids is not None and pk not in self.allowed_site_ids:
+                raise ValidationError(self.error_messages['invalid_choice'] % pk)
+            if pk not in pks:
+                pks.append(pk)
+        sites = self.selected_sites(pks)
+        for pk in pks:
+            if pk not in sites:
+                raise ValidationError(self.error_messages['invalid_choice'] % pk)
+        self.run_validators(value)
+        return [sites[pk] for pk in pks]
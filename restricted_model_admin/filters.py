@@ -0,0 +1,28 @@
+from django.contrib.admin import SimpleListFilter
+from django.utils.translation import ugettext_lazy as _
+
+
+class ReadOnlyListFilter(SimpleListFilter):
+    """list_filter choice between the locked and the editable objects of an
+    admin decorated by ``restricted__queryset__override``, filtered in SQL
+    with the condition of its ``read_only_filter``.
+    """
+    title = _('locked')
+    parameter_name = 'is_read_only'
+
+    def __init__(self, request, params, model, model_admin):
+        self.model_admin = model_admin
+        super(ReadOnlyListFilter, self).__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return (('1', _('Yes')), ('0', _('No')))
+
+    def queryset(self, request, queryset):
+        if self.value() not in ('0', '1'):
+            return queryset
+        locked = self.model_admin.read_only_filter()
+        if locked is None:
+            return queryset if self.value() == '0' else queryset.none()
+        if self.value() == '1':
+            return queryset.filter(locked)
+        return queryset.exclude(locked)
@@ -0,0 +1,217 @@
+import logging
+import time
+from collections import namedtuple
+from functools import wraps
+from threading import local, Lock
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+
+# sent after every instrumented override call, with the admin class as sender
+override_called = Signal(providing_args=['decorator', 'method', 'duration',
+                                         'queries', 'rows'])
+
+OverrideCall = namedtuple('OverrideCall',
+                          'admin_class decorator method duration queries rows')
+
+
+def instrumentation_enabled():
+    return getattr(settings, 'RESTRICTED_MODEL_ADMIN_INSTRUMENTATION', False)
+
+
+class CountingCursor(object):
+    """Cursor proxy counting the statements executed and the rows fetched
+    through it into ``counter``.
+    """
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, *args, **kwargs):
+        self.counter.queries += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter.queries += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.counter.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.counter.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.counter.rows += len(rows)
+        return rows
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.counter.rows += 1
+            yield row
+
+
+class _Counter(local):
+    depth = 0
+    queries = 0
+    rows = 0
+
+
+_counter = _Counter()
+
+
+def _count_queries():
+    # the outermost instrumented call hooks the cursors of this thread's
+    # connections, nested calls read the same counters
+    for connection in connections.all():
+        def cursor(original=connection.cursor):
+            return CountingCursor(original(), _counter)
+        connection.cursor = cursor
+
+
+def _stop_counting_queries():
+    for connection in connections.all():
+        connection.__dict__.pop('cursor', None)
+
+
+def instrumented(function, decorator, method):
+    """Wraps the override ``function`` so every call sends
+    ``override_called`` with its wall time in milliseconds and the number of
+    queries executed and rows fetched during the call.
+    """
+    @wraps(function)
+    def _instrumented(self, *args, **kwargs):
+        if not _counter.depth:
+            _count_queries()
+        _counter.depth += 1
+        queries, rows = _counter.queries, _counter.rows
+        start = time.time()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            duration = (time.time() - start) * 1000
+            _counter.depth -= 1
+            if not _counter.depth:
+                _stop_counting_queries()
+            override_called.send(sender=type(self), decorator=decorator,
+                                 method=method, duration=duration,
+                                 queries=_counter.queries - queries,
+                                 rows=_counter.rows - rows)
+    _instrumented.instrumented = function
+    return _instrumented
+
+
+def instrument_overrides(cls, decorator, options, methods):
+    """Replaces the ``methods`` a restricted decorator installed on ``cls``
+    by instrumented wrappers when the ``instrument`` option, or the
+    RESTRICTED_MODEL_ADMIN_INSTRUMENTATION setting, is set at decoration
+    time.  Otherwise the class is left untouched and costs nothing.
+    """
+    instrument = options.get('instrument')
+    if instrument is None:
+        instrument = instrumentation_enabled()
+    if not instrument:
+        return
+    install_collectors()
+    for method in methods:
+        setattr(cls, method, instrumented(cls.__dict__[method], decorator, method))
+
+
+class Collector(object):
+    """Base class of the receivers of ``override_called``; subclasses
+    implement ``collect``, which gets an OverrideCall per instrumented call.
+    """
+
+    def connect(self):
+        override_called.connect(self.receive, weak=False,
+                                dispatch_uid=('restricted_model_admin', id(self)))
+        return self
+
+    def disconnect(self):
+        override_called.disconnect(dispatch_uid=('restricted_model_admin', id(self)))
+
+    def receive(self, sender, decorator, method, duration, queries, rows, **kwargs):
+        self.collect(OverrideCall(sender, decorator, method, duration, queries, rows))
+
+    def collect(self, call):
+        raise NotImplementedError
+
+
+class LoggingCollector(Collector):
+    """Logs one line per call to the ``restricted_model_admin.instrumentation``
+    logger.
+    """
+
+    def __init__(self, logger='restricted_model_admin.instrumentation',
+                 level=logging.DEBUG):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def collect(self, call):
+        self.logger.log(self.level, '%s.%s (%s): %.3f ms, %d queries, %d rows',
+                        call.admin_class.__name__, call.method, call.decorator,
+                        call.duration, call.queries, call.rows)
+
+
+class AggregateCollector(Collector):
+    """Keeps running totals per admin class and method in memory."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = {}
+
+    def collect(self, call):
+        key = (call.admin_class, call.method)
+        with self.lock:
+            total = self.totals.get(key)
+            if total is None:
+                total = self.totals[key] = {
+                    'decorator': call.decorator, 'calls': 0, 'duration': 0.0,
+                    'max_duration': 0.0, 'queries': 0, 'rows': 0}
+            total['calls'] += 1
+            total['duration'] += call.duration
+            total['max_duration'] = max(total['max_duration'], call.duration)
+            total['queries'] += call.queries
+            total['rows'] += call.rows
+
+    def summary(self):
+        """Returns the totals as a list of dictionaries, slowest first."""
+        with self.lock:
+            rows = [dict(total, admin_class=admin_class.__name__, method=method,
+                         mean_duration=total['duration'] / total['calls'])
+                    for (admin_class, method), total in self.totals.items()]
+        return sorted(rows, key=lambda row: row['duration'], reverse=True)
+
+
+_collectors = None
+
+
+def install_collectors():
+    """Instantiates and connects, once, the collector classes named in the
+    RESTRICTED_MODEL_ADMIN_INSTRUMENTATION_COLLECTORS setting.
+    """
+    global _collectors
+    if _collectors is not None:
+        return _collectors
+    collectors = []
+    for path in getattr(settings, 'RESTRICTED_MODEL_ADMIN_INSTRUMENTATION_COLLECTORS', ()):
+        module, name = path.rsplit('.', 1)
+        collectors.append(getattr(import_module(module), name)().connect())
+    _collectors = collectors
+    return collectors
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from restricted_model_admin.models import UserSiteAccess
+
+
+class Command(BaseCommand):
+    args = '<rebuild|verify>'
+    help = ('Rebuilds the user site access table from the GlobalPagePermissions '
+            'or verifies that it is in sync with them.')
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in ('rebuild', 'verify'):
+            raise CommandError('Usage: restricted_site_access %s' % self.args)
+        if args[0] == 'rebuild':
+            added, removed = UserSiteAccess.objects.rebuild()
+            self.stdout.write('Added %d and removed %d user site access rows.\n'
+                              % (added, removed))
+            return
+        missing, stale = UserSiteAccess.objects.verify()
+        if missing or stale:
+            raise CommandError('%d user site access rows are missing and %d are '
+                               'stale, run "restricted_site_access rebuild".'
+                               % (len(missing), len(stale)))
+        self.stdout.write('The user site access table is in sync.\n')
@@ -8,27 +8,17 @@ from django.db import models
 class Migration(SchemaMigration):
 
     def forwards(self, orm):
-        # Adding model 'RestrictedFields'
-        db.create_table('restricted_model_admin_restrictedfields', (
-            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
-            ('pbs_provided', self.gf('django.db.models.fields.BooleanField')(default=False)),
-            ('read_only', self.gf('django.db.models.fields.BooleanField')(default=False)),
-        ))
-        db.send_create_signal('restricted_model_admin', ['RestrictedFields'])
+        # The restricted fields mixins are abstract, their columns and indexes
+        # belong to the models using them. Older releases created a
+        # 'restricted_model_admin_restrictedfields' table here, which
+        # 0003_remove_restrictedfields drops.
+        pass
 
 
     def backwards(self, orm):
-        # Deleting model 'RestrictedFields'
-        db.delete_table('restricted_model_admin_restrictedfields')
+        pass
 
 
-    models = {
-        'restricted_model_admin.restrictedfields': {
-            'Meta': {'object_name': 'RestrictedFields'},
-            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
-            'pbs_provided': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
-            'read_only': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
-        }
-    }
+    models = {}
 
-    complete_apps = ['restricted_model_admin']
\ No newline at end of file
+    complete_apps = ['restricted_model_admin']
@@ -1,9 +1,35 @@
+from django.conf import settings
 from django.db import models
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
 from django.utils.translation import ugettext_lazy as _
+from permissions import user_site_pairs, SitePermissionSet
+from query import RestrictedQuerySet
+
+# Staff changelists filter on pbs_provided and bulk deletions on both flags,
+# so they are indexed unless RESTRICTED_MODEL_ADMIN_INDEX_FLAGS is False. The
+# setting is read when the mixins are defined; models using them need a
+# schema migration of their own after changing it.
+INDEX_FLAGS = getattr(settings, 'RESTRICTED_MODEL_ADMIN_INDEX_FLAGS', True)
+
+
+class RestrictedManager(models.Manager):
+    """Manager giving ``restricted_for`` to the models using the restricted
+    fields mixins.  The mixins leave the managers of their models alone, so
+    models opt in by declaring it, or a manager derived from it.
+    """
+
+    def get_query_set(self):
+        return RestrictedQuerySet(self.model, using=self._db)
+
+    def restricted_for(self, user, **kwargs):
+        return self.get_query_set().restricted_for(user, **kwargs)
+
 
 #BlogEntry and Robots Rule inherit from this class because they don't have read_only field
 class RestrictedPBSProvidedMixin(models.Model):
-    pbs_provided = models.BooleanField(_('pbs provided'), default=False)
+    pbs_provided = models.BooleanField(_('pbs provided'), default=False,
+                                       db_index=INDEX_FLAGS)
 
     class Meta:
         abstract = True
@@ -22,7 +48,8 @@ class RestrictedFieldsMixin(RestrictedPBSProvidedMixin):
     and READ_ONLY to SOME users. So a template/snippet can have 'PBS Provided'
     field to False an still be read only (if 'Read Only field is True').
     """
-    read_only = models.BooleanField(_('read only'), default=False)
+    read_only = models.BooleanField(_('read only'), default=False,
+                                    db_index=INDEX_FLAGS)
 
     class Meta:
         abstract = True
@@ -30,3 +57,70 @@ class RestrictedFieldsMixin(RestrictedPBSProvidedMixin):
     def get_readonly_fields_for_stuff_users(self):
         return super(RestrictedFieldsMixin, self).get_readonly_fields_for_stuff_users() + \
             ['read_only']
+
+
+
+class UserSiteAccessManager(models.Manager):
+
+    def site_ids(self, user, using=None):
+        return SitePermissionSet(self.db_manager(using).filter(user=user)
+                                 .values_list('site', flat=True))
+
+    def refresh(self, user_ids):
+        """Incrementally brings the rows of ``user_ids`` in line with their
+        GlobalPagePermissions.
+        """
+        user_ids = list(user_ids)
+        self._sync(user_site_pairs(user_ids), self.filter(user__in=user_ids))
+
+    def rebuild(self):
+        """Brings the whole table in line with the GlobalPagePermissions and
+        returns the number of rows added and removed.
+        """
+        return self._sync(user_site_pairs(), self.all())
+
+    def verify(self):
+        """Returns the ``(user_id, site_id)`` pairs missing from the table and
+        the ones it holds without a matching GlobalPagePermission.
+        """
+        expected = user_site_pairs()
+        current = set(self.values_list('user', 'site'))
+        return expected - current, current - expected
+
+    def _sync(self, expected, current_rows):
+        current = dict(((user_id, site_id), pk) for pk, user_id, site_id
+                       in current_rows.values_list('pk', 'user', 'site'))
+        stale = [pk for pair, pk in current.items() if pair not in expected]
+        if stale:
+            self.filter(pk__in=stale).delete()
+        missing = [self.model(user_id=user_id, site_id=site_id)
+                   for user_id, site_id in expected if (user_id, site_id) not in current]
+        if missing:
+            self.bulk_create(missing)
+        return len(missing), len(stale)
+
+
+class UserSiteAccess(models.Model):
+    """
+    Denormalized (user, site) pairs of the sites each user is granted through
+    GlobalPagePermissions, directly or through groups. It is only maintained
+    and used when the RESTRICTED_MODEL_ADMIN_ACCESS_TABLE setting is enabled;
+    the restricted_site_access management command populates it.
+    """
+    user = models.ForeignKey(User, related_name='restricted_site_access')
+    site = models.ForeignKey(Site, related_name='restricted_user_access')
+
+    objects = UserSiteAccessManager()
+
+    class Meta:
+        unique_together = (('user', 'site'),)
+        verbose_name = _('user site access')
+        verbose_name_plural = _('user site access')
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.user_id, self.site_id)
+
+
+# connects the handlers keeping the cached site permissions and the access
+# table up to date
+import signals
@@ -0,0 +1,194 @@
+import hashlib
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page, InvalidPage, EmptyPage
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.encoding import smart_str
+
+
+EXACT_COUNT = None
+CACHED_COUNT = 'cached'
+CAPPED_COUNT = 'capped'
+COUNT_MODES = (EXACT_COUNT, CACHED_COUNT, CAPPED_COUNT)
+COUNT_CACHE_KEY = 'restricted_model_admin:count:%s'
+
+
+class CappedCount(int):
+    """Row count known only to be larger than ``cap``; it renders as "N+" in
+    the changelist so the number is not mistaken for an exact total.
+    """
+
+    def __new__(cls, cap):
+        return super(CappedCount, cls).__new__(cls, cap + 1)
+
+    def __unicode__(self):
+        return u'%d+' % (self - 1)
+
+    __str__ = __unicode__
+
+
+def count_queryset(queryset, count_mode=EXACT_COUNT, count_cap=1000):
+    """Counts ``queryset`` according to ``count_mode``.
+
+    ``'cached'`` serves the exact count from Django's cache for
+    RESTRICTED_MODEL_ADMIN_COUNT_CACHE_TIMEOUT seconds, keyed by the SQL of
+    the query.  ``'capped'`` fetches at most ``count_cap + 1`` primary keys
+    and returns a CappedCount when there are more.
+    """
+    if count_mode == CAPPED_COUNT:
+        pks = queryset.order_by().values_list('pk', flat=True)[:count_cap + 1]
+        count = len(pks)
+        return CappedCount(count_cap) if count > count_cap else count
+    if count_mode == CACHED_COUNT:
+        try:
+            sql = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = COUNT_CACHE_KEY % hashlib.md5(smart_str(repr(sql))).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(
+                settings, 'RESTRICTED_MODEL_ADMIN_COUNT_CACHE_TIMEOUT', None))
+        return count
+    return queryset.count()
+
+
+class RestrictedPaginator(Paginator):
+    """Paginator counting its object list with ``count_queryset``.
+
+    With a capped count, pages past the cap stay reachable: a page number is
+    valid as long as the page has rows.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, count_mode=EXACT_COUNT,
+                 count_cap=1000):
+        super(RestrictedPaginator, self).__init__(
+            object_list, per_page, orphans, allow_empty_first_page)
+        self.count_mode = count_mode
+        self.count_cap = count_cap
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = count_queryset(self.object_list, self.count_mode,
+                                         self.count_cap)
+        return self._count
+    count = property(_get_count)
+
+    def validate_number(self, number):
+        try:
+            return super(RestrictedPaginator, self).validate_number(number)
+        except EmptyPage:
+            if not isinstance(self.count, CappedCount) or int(number) < 1:
+                raise
+            bottom = (int(number) - 1) * self.per_page
+            if not self.object_list[bottom:bottom + 1].exists():
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count and not isinstance(self.count, CappedCount):
+            top = self.count
+        return Page(self.object_list[bottom:top], number, self)
+
+
+class RestrictedChangeList(ChangeList):
+    """ChangeList counting the unfiltered total the same way as its
+    paginator, instead of always running an exact COUNT.
+
+    The restricted queryset always carries a WHERE clause, so an unfiltered
+    changelist is recognised by ``selects_same_rows``, in which case the
+    page count is reused.
+
+    Admins providing ``prefetch_changelist_sites`` get to add their sites
+    prefetch to the changelist rows, and admins providing
+    ``get_read_database`` get the counts and rows of a non editable
+    changelist read from the database it names.
+    """
+
+    def get_query_set(self, request):
+        queryset = super(RestrictedChangeList, self).get_query_set(request)
+        prefetch = getattr(self.model_admin, 'prefetch_changelist_sites', None)
+        if prefetch is not None:
+            queryset = prefetch(request, queryset)
+        return queryset
+
+    def read_database(self, request):
+        get_read_database = getattr(self.model_admin, 'get_read_database', None)
+        if get_read_database is None or self.list_editable:
+            # edited rows are saved on the database they were read from
+            return None
+        return get_read_database(request)
+
+    def get_results(self, request):
+        query_set, root_query_set = self.query_set, self.root_query_set
+        alias = self.read_database(request)
+        if alias:
+            query_set, root_query_set = query_set.using(alias), root_query_set.using(alias)
+        paginator = self.model_admin.get_paginator(request, query_set, self.list_per_page)
+        result_count = paginator.count
+
+        if selects_same_rows(query_set, root_query_set):
+            full_result_count = result_count
+        else:
+            full_result_count = count_queryset(
+                root_query_set, getattr(paginator, 'count_mode', EXACT_COUNT),
+                getattr(paginator, 'count_cap', 1000))
+
+        # a capped count is only a lower bound of the rows
+        can_show_all = (result_count <= self.list_max_show_all and
+                        not isinstance(result_count, CappedCount))
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num+1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+def selects_same_rows(queryset, root_queryset):
+    """Tells whether ``queryset`` selects the rows of ``root_queryset``,
+    that is whether the admin filters and search left it unchanged but for
+    its ordering and the columns it fetches.
+    """
+    if isinstance(queryset, EmptyQuerySet) or isinstance(root_queryset, EmptyQuerySet):
+        return (isinstance(queryset, EmptyQuerySet) and
+                isinstance(root_queryset, EmptyQuerySet))
+    try:
+        return (queryset.order_by().values_list('pk').query.sql_with_params() ==
+                root_queryset.order_by().values_list('pk').query.sql_with_params())
+    except EmptyResultSet:
+        return False
+
+
+_changelists = {}
+
+
+def restricted_changelist(base):
+    """Returns ``base`` with RestrictedChangeList's counting mixed in, so
+    admins keep their own ChangeList customizations.
+    """
+    if issubclass(base, RestrictedChangeList):
+        return base
+    changelist = _changelists.get(base)
+    if changelist is None:
+        changelist = _changelists[base] = type(
+            'Restricted%s' % base.__name__, (RestrictedChangeList, base), {})
+    return changelist
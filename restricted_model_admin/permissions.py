@@ -0,0 +1,229 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
+from cms.models.permissionmodels import GlobalPagePermission
+
+
+REQUEST_CACHE_ATTRIBUTE = '_restricted_model_admin_cache'
+SITE_IDS_CACHE_KEY = 'restricted_model_admin:site_ids:%s'
+RENDERING_METHODS = ('GET', 'HEAD')
+
+
+class SitePermissionSet(frozenset):
+    """Immutable set of site ids.
+
+    It is a frozenset of integers: membership and the set operations are
+    hash lookups, and the set pickles to a size following the number of
+    sites.  Membership also accepts the string ids of submitted forms.
+    """
+    __slots__ = ()
+
+    def __new__(cls, site_ids=()):
+        return super(SitePermissionSet, cls).__new__(
+            cls, (int(site_id) for site_id in site_ids))
+
+    def __contains__(self, site_id):
+        try:
+            site_id = int(site_id)
+        except (TypeError, ValueError):
+            return False
+        return frozenset.__contains__(self, site_id)
+
+    def issuperset(self, site_ids):
+        """Tells whether every id of ``site_ids`` is in the set."""
+        return all(site_id in self for site_id in site_ids)
+
+    def __repr__(self):
+        return 'SitePermissionSet(%r)' % sorted(self)
+
+
+def request_cache(request):
+    """Returns the dictionary used to memoize restriction data for the
+    lifetime of ``request``.
+
+    The dictionary lives in the request instance dict so it is dropped
+    together with the request.
+    """
+    return request.__dict__.setdefault(REQUEST_CACHE_ATTRIBUTE, {})
+
+
+def get_allowed_site_ids(request, alias=None):
+    """Returns the SitePermissionSet of the sites ``request.user`` has a
+    GlobalPagePermission for, computed at most once per request and read
+    from the ``permission_database(request, alias)`` database.
+    """
+    memo = request_cache(request)
+    key = ('allowed_site_ids', request.user.pk)
+    if key not in memo:
+        memo[key] = cached_user_site_ids(
+            request.user, lambda: get_user_group_ids(request, alias),
+            permission_database(request, alias))
+    return memo[key]
+
+
+def permission_database(request, alias=None):
+    """Returns the database the permissions of ``request.user`` are read
+    from: ``read_database(alias)`` for GET and HEAD requests, which only
+    render, and the primary for any request that may write, so a lagging
+    replica never lets a revoked site guard a write.
+    """
+    if getattr(request, 'method', None) in RENDERING_METHODS:
+        return read_database(alias)
+    return None
+
+
+def get_user_group_ids(request, alias=None):
+    """Returns the ids of the groups of ``request.user``, computed at most
+    once per request.
+    """
+    memo = request_cache(request)
+    key = ('group_ids', request.user.pk)
+    if key not in memo:
+        memo[key] = user_group_ids(request.user, permission_database(request, alias))
+    return memo[key]
+
+
+def user_group_ids(user, using=None):
+    """Reads the group ids of ``user`` from the membership table alone."""
+    memberships = User.groups.through._default_manager.db_manager(using)
+    return frozenset(memberships.filter(user=user).values_list('group', flat=True))
+
+
+def get_allowed_site_lookup(request, alias=None):
+    """Returns a value for ``site__in`` style lookups selecting the sites
+    allowed to ``request.user``.
+
+    With the access table enabled this is a subquery on its (user, site)
+    index, otherwise the ids returned by ``get_allowed_site_ids``.
+    """
+    if access_table_enabled():
+        return user_site_lookup(request.user)
+    return get_allowed_site_ids(request, alias)
+
+
+def user_site_lookup(user):
+    """``get_allowed_site_lookup`` for code paths without a request."""
+    if access_table_enabled():
+        from models import UserSiteAccess
+        return UserSiteAccess.objects.filter(user=user).values('site')
+    return cached_user_site_ids(user, using=read_database())
+
+
+def read_database(alias=None):
+    """Returns the database alias read-only restriction lookups go to:
+    ``alias``, else the RESTRICTED_MODEL_ADMIN_READ_DATABASE setting, else
+    None for the default routing.
+    """
+    return alias or getattr(settings, 'RESTRICTED_MODEL_ADMIN_READ_DATABASE', None)
+
+
+def site_cache_enabled():
+    return getattr(settings, 'RESTRICTED_MODEL_ADMIN_SITE_CACHE', False)
+
+
+def access_table_enabled():
+    return getattr(settings, 'RESTRICTED_MODEL_ADMIN_ACCESS_TABLE', False)
+
+
+def permission_tracking_enabled():
+    return site_cache_enabled() or access_table_enabled()
+
+
+def cached_user_site_ids(user, group_ids=None, using=None):
+    """Returns ``user_site_ids(user)``, going through Django's cache when the
+    RESTRICTED_MODEL_ADMIN_SITE_CACHE setting is enabled.  ``group_ids`` is
+    an optional callable returning the ids of the groups of ``user``.
+
+    Uncached site ids are read from the ``using`` database.
+    Entries are dropped by the signal handlers in
+    ``restricted_model_admin.signals`` whenever a permission, its sites or
+    the user's groups change, and are refilled from the primary: a lagging
+    replica would put revoked sites back in the cache until it expires.
+    """
+    if not site_cache_enabled():
+        return resolve_user_site_ids(user, group_ids() if group_ids else None,
+                                     using)
+    key = SITE_IDS_CACHE_KEY % user.pk
+    site_ids = cache.get(key)
+    if site_ids is None:
+        site_ids = resolve_user_site_ids(user)
+        cache.set(key, site_ids, getattr(
+            settings, 'RESTRICTED_MODEL_ADMIN_SITE_CACHE_TIMEOUT', None))
+    return site_ids
+
+
+def resolve_user_site_ids(user, group_ids=None, using=None):
+    if access_table_enabled():
+        from models import UserSiteAccess
+        return UserSiteAccess.objects.site_ids(user, using)
+    return user_site_ids(user, group_ids, using)
+
+
+def user_permissions_changed(user_ids):
+    """Brings the cached site ids and the access table rows of ``user_ids``
+    in line with their current permissions.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    if site_cache_enabled():
+        cache.delete_many([SITE_IDS_CACHE_KEY % pk for pk in user_ids])
+    if access_table_enabled():
+        from models import UserSiteAccess
+        UserSiteAccess.objects.refresh(user_ids)
+
+
+def permission_user_ids(permissions):
+    """Returns the ids of every user granted something by ``permissions``, an
+    iterable of ``(user_id, group_id)`` pairs of GlobalPagePermissions.
+    """
+    user_ids = set()
+    group_ids = set()
+    for user_id, group_id in permissions:
+        if user_id is not None:
+            user_ids.add(user_id)
+        if group_id is not None:
+            group_ids.add(group_id)
+    if group_ids:
+        user_ids.update(User.objects.filter(groups__in=group_ids)
+                                    .values_list('pk', flat=True))
+    return user_ids
+
+
+def user_site_ids(user, group_ids=None, using=None):
+    """Resolves the sites granted to ``user`` directly and through the groups
+    ``group_ids`` (by default read from the membership table) with one query
+    on the GlobalPagePermission sites table of the ``using`` database.
+
+    Groups are matched by id, so the query never joins the group membership
+    and a user without groups only looks at direct permissions.
+    """
+    if group_ids is None:
+        group_ids = user_group_ids(user, using)
+    granted = Q(globalpagepermission__user=user)
+    if group_ids:
+        granted |= Q(globalpagepermission__group__in=group_ids)
+    permission_sites = (GlobalPagePermission.sites.through._default_manager
+                        .db_manager(using))
+    return SitePermissionSet(permission_sites.filter(granted)
+                             .values_list('site', flat=True))
+
+
+def user_site_pairs(user_ids=None):
+    """Returns the ``(user_id, site_id)`` pairs granted by GlobalPagePermissions
+    to ``user_ids``, or to every user when ``user_ids`` is None.
+    """
+    permission_sites = GlobalPagePermission.sites.through._default_manager
+    # each lookup set goes through a single filter() call so the multi-valued
+    # group membership is joined only once
+    direct = {'globalpagepermission__user__isnull': False}
+    grouped = {'globalpagepermission__group__user__isnull': False}
+    if user_ids is not None:
+        direct['globalpagepermission__user__in'] = user_ids
+        grouped['globalpagepermission__group__user__in'] = user_ids
+    pairs = set(permission_sites.filter(**direct)
+                .values_list('globalpagepermission__user', 'site'))
+    pairs.update(permission_sites.filter(**grouped)
+                 .values_list('globalpagepermission__group__user', 'site'))
+    return pairs
@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+
+JOIN_STRATEGY = 'join'
+SUBQUERY_STRATEGY = 'subquery'
+QUERYSET_STRATEGIES = (JOIN_STRATEGY, SUBQUERY_STRATEGY)
+
+OPTION_DEFAULTS = (
+    ('restrict_user', False),
+    ('include_orphan', True),
+    ('allways_ro', ()),
+    ('shared_and_readonly', True),
+    ('strategy', JOIN_STRATEGY),
+    ('sites_autocomplete', False),
+    ('count_mode', None),
+    ('count_cap', 1000),
+    ('flag_actions', True),
+    ('annotate_read_only', False),
+    ('prefetch_sites', False),
+    ('export_actions', False),
+    ('read_database', None),
+)
+
+OPTION_NAMES = tuple(name for name, default in OPTION_DEFAULTS)
+
+POLICY_FIELDS = ('model', ) + OPTION_NAMES + (
+    # model capabilities
+    'has_pbs_provided', 'has_read_only', 'has_sites',
+    # precomputed read only fields
+    'all_field_names', 'staff_readonly_fields',
+)
+
+
+class RestrictionPolicy(namedtuple('RestrictionPolicy', POLICY_FIELDS)):
+    """
+    Immutable snapshot of the options a restricted ModelAdmin was decorated
+    with and of the model metadata the overrides need, so that no model
+    introspection happens while serving a request.
+    """
+    __slots__ = ()
+
+
+_policies = {}
+
+
+def restriction_policy(model, **options):
+    """Returns the RestrictionPolicy of ``model`` for the given decorator
+    options; options the policy does not know about are ignored.
+
+    Policies are built on first use, once the app cache is ready, and shared
+    by every override decorated with the same options.
+    """
+    values = []
+    for name, default in OPTION_DEFAULTS:
+        value = options.get(name, default)
+        if isinstance(value, list):
+            value = tuple(value)
+        values.append(value)
+    key = (model, ) + tuple(values)
+    policy = _policies.get(key)
+    if policy is None:
+        policy = _policies[key] = _build_policy(model, values)
+    return policy
+
+
+def _build_policy(model, option_values):
+    field_names = tuple(model._meta.get_all_field_names())
+    staff_readonly_fields = ()
+    if hasattr(model, 'get_readonly_fields_for_stuff_users'):
+        staff_readonly_fields = tuple(model().get_readonly_fields_for_stuff_users())
+    options = dict(zip(OPTION_NAMES, option_values))
+    return RestrictionPolicy(
+        model=model,
+        has_pbs_provided='pbs_provided' in field_names,
+        has_read_only='read_only' in field_names,
+        has_sites='sites' in [f.name for f in model._meta.many_to_many],
+        all_field_names=field_names,
+        staff_readonly_fields=staff_readonly_fields,
+        **options
+    )
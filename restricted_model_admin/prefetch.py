@@ -0,0 +1,74 @@
+from collections import defaultdict
+from django.db.models.query import prefetch_related_objects
+
+
+SITES_LOOKUP = 'sites'
+
+
+class SitesPrefetchMixin(object):
+    """QuerySet mixin prefetching the ``sites`` of the fetched objects with
+    one query, keeping only the sites in ``_prefetch_site_ids`` (ids or a
+    subquery).  ``obj.sites.all()`` then serves them without a query.
+    """
+    _prefetch_site_ids = None
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        if klass is None or issubclass(klass, SitesPrefetchMixin):
+            kwargs.setdefault('_prefetch_site_ids', self._prefetch_site_ids)
+        return super(SitesPrefetchMixin, self)._clone(klass, setup, **kwargs)
+
+    def _prefetch_related_objects(self):
+        lookups = [lookup for lookup in self._prefetch_related_lookups
+                   if lookup != SITES_LOOKUP]
+        if lookups:
+            prefetch_related_objects(self._result_cache, lookups)
+        if SITES_LOOKUP in self._prefetch_related_lookups:
+            prefetch_permitted_sites(self._result_cache, self._prefetch_site_ids)
+        self._prefetch_done = True
+
+
+def prefetch_permitted_sites(objs, site_ids):
+    """Fills the ``sites`` prefetch cache of ``objs`` with their sites among
+    ``site_ids``, in the sites' default ordering.
+    """
+    if not objs:
+        return
+    sites_field = objs[0]._meta.get_field(SITES_LOOKUP)
+    object_column = sites_field.m2m_field_name()
+    site_column = sites_field.m2m_reverse_field_name()
+    ordering = ['%s%s__%s' % ('-' if o.startswith('-') else '', site_column,
+                              o.lstrip('-'))
+                for o in sites_field.rel.to._meta.ordering]
+    links = (sites_field.rel.through._default_manager.db_manager(objs[0]._state.db)
+             .filter(**{'%s__in' % object_column: [obj.pk for obj in objs],
+                        '%s__in' % site_column: site_ids})
+             .select_related(site_column).order_by(*ordering))
+    sites = defaultdict(list)
+    for link in links:
+        sites[getattr(link, '%s_id' % object_column)].append(
+            getattr(link, site_column))
+    for obj in objs:
+        queryset = getattr(obj, SITES_LOOKUP).all()
+        queryset._result_cache = sites[obj.pk]
+        queryset._prefetch_done = True
+        if not hasattr(obj, '_prefetched_objects_cache'):
+            obj._prefetched_objects_cache = {}
+        obj._prefetched_objects_cache[SITES_LOOKUP] = queryset
+
+
+_querysets = {}
+
+
+def prefetch_sites(queryset, site_ids=None):
+    """Returns ``queryset`` prefetching the sites of its objects; only the
+    sites in ``site_ids`` are kept unless it is None.
+    """
+    if site_ids is None:
+        return queryset.prefetch_related(SITES_LOOKUP)
+    base = queryset.__class__
+    klass = base if issubclass(base, SitesPrefetchMixin) else _querysets.get(base)
+    if klass is None:
+        klass = _querysets[base] = type(
+            'SitesPrefetch%s' % base.__name__, (SitesPrefetchMixin, base), {})
+    queryset = queryset._clone(klass=klass, _prefetch_site_ids=site_ids)
+    return queryset.prefetch_related(SITES_LOOKUP)
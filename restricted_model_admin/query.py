@@ -0,0 +1,78 @@
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from permissions import user_site_lookup
+from policy import restriction_policy, JOIN_STRATEGY, SUBQUERY_STRATEGY
+
+
+def restrict_queryset(queryset, policy, user, site_ids):
+    """Restricts ``queryset`` to the rows of ``policy.model`` that ``user``
+    may see, as the restricted admin changelist does.
+
+    ``site_ids`` are the sites the user is allowed to see (ids or a
+    subquery), or None when the user is not restricted by sites.
+    """
+    if policy.strategy == SUBQUERY_STRATEGY:
+        return queryset.filter(restriction_subquery_filter(policy, user, site_ids))
+    f = Q()
+    if not user.is_superuser:
+        if site_ids is not None:
+            f |= Q(sites__in=site_ids)
+        if policy.has_pbs_provided:
+            f |= Q(pbs_provided=True)
+
+        if policy.include_orphan:
+            f |= Q(sites__isnull=True)
+    return queryset.filter(f).distinct()
+
+
+def restriction_subquery_filter(policy, user, site_ids):
+    """Builds the restriction filter for ``policy.model`` without joining the
+    sites relation into the outer query.
+
+    ``site_ids`` are the sites the user is allowed to see (ids or a
+    subquery), or None when the user is not restricted by sites.  Every site
+    related condition is an IN subquery on the sites M2M table, so each
+    object row matches at most once and no DISTINCT is needed.
+    """
+    f = Q()
+    if user.is_superuser:
+        return f
+    if site_ids is not None or policy.include_orphan:
+        sites_field = policy.model._meta.get_field('sites')
+        through = sites_field.rel.through._default_manager
+        object_column = sites_field.m2m_field_name()
+        site_column = sites_field.m2m_reverse_field_name()
+    if site_ids is not None:
+        f |= Q(pk__in=through.filter(
+            **{'%s__in' % site_column: site_ids}).values(object_column))
+    if policy.has_pbs_provided:
+        f |= Q(pbs_provided=True)
+    if policy.include_orphan:
+        f |= ~Q(pk__in=through.values(object_column))
+    return f
+
+
+class RestrictedQuerySet(QuerySet):
+    """QuerySet of the models built on the restricted fields mixins, giving
+    code outside the admin the rows a restricted admin shows.
+    """
+
+    def restricted_for(self, user, restrict_user=True, include_orphan=True,
+                       strategy=JOIN_STRATEGY, pks_only=False):
+        """Returns the rows ``user`` would see in an admin decorated with the
+        same options, ordered by primary key so that ``iterator()`` and
+        keyset paging over large sets are stable.
+
+        With ``pks_only`` only the primary keys are fetched.  The sites of
+        ``user`` are resolved here; run it again after they change.
+        """
+        policy = restriction_policy(self.model, restrict_user=restrict_user,
+                                    include_orphan=include_orphan,
+                                    strategy=strategy)
+        site_ids = None
+        if policy.restrict_user and not user.is_superuser:
+            site_ids = user_site_lookup(user)
+        queryset = restrict_queryset(self, policy, user, site_ids).order_by('pk')
+        if pks_only:
+            return queryset.values_list('pk', flat=True)
+        return queryset
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.contrib.admin import helpers
+from permissions import request_cache
+
+
+SELECT_ACROSS_VALUES = ('1', 'on', 'true', 'True')
+
+
+def chunk_size():
+    return getattr(settings, 'RESTRICTED_MODEL_ADMIN_CHUNK_SIZE', 500)
+
+
+def is_select_across(request):
+    """Tells whether a changelist action was posted for all the objects of
+    the changelist ("select all N items") rather than for the checked ones.
+    """
+    return request.POST.get('select_across') in SELECT_ACROSS_VALUES
+
+
+def remember_action_queryset(request, model, queryset):
+    request_cache(request)[('action_queryset', model)] = queryset
+
+
+def action_queryset(model_admin, request):
+    """Returns the changelist queryset an action was posted for, falling back
+    to the restricted queryset of ``model_admin``.
+    """
+    queryset = request_cache(request).get(('action_queryset', model_admin.model))
+    if queryset is None:
+        queryset = model_admin.queryset(request)
+    return queryset
+
+
+def selected_pk_chunks(model_admin, request, size=None):
+    """Yields the primary keys of the objects checked in the changelist an
+    action was posted from, in lists of at most ``size`` keys.  "Select all"
+    selections are answered from ``action_queryset`` instead.
+    """
+    size = size or chunk_size()
+    selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+    for start in range(0, len(selected), size):
+        yield selected[start:start + size]
+
+
+def queryset_value_chunks(queryset, fields, size=None):
+    """Yields the ``fields`` values of the rows of ``queryset`` in primary key
+    order, in lists of at most ``size`` tuples, paging on the key so memory
+    stays flat however many rows the queryset has.
+    """
+    size = size or chunk_size()
+    rows = queryset.order_by('pk').values_list('pk', *fields)
+    last_pk = None
+    while True:
+        page = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+        chunk = list(page[:size])
+        if not chunk:
+            return
+        yield [row[1:] for row in chunk]
+        if len(chunk) < size:
+            return
+        last_pk = chunk[-1][0]
@@ -0,0 +1,85 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import (pre_save, post_save, pre_delete,
+                                      post_delete, m2m_changed)
+from cms.models.permissionmodels import GlobalPagePermission
+from permissions import (permission_tracking_enabled, user_permissions_changed,
+                         permission_user_ids)
+
+
+AFFECTED_USERS_ATTRIBUTE = '_restricted_model_admin_affected_users'
+
+
+def permission_pre_change(sender, instance, **kwargs):
+    # group memberships and the previous owner of the permission are read
+    # before the row changes, the cache and access table are only updated
+    # once it did
+    if not permission_tracking_enabled():
+        return
+    owners = [(instance.user_id, instance.group_id)]
+    if instance.pk is not None and not kwargs.get('raw'):
+        owners.extend(GlobalPagePermission.objects.filter(pk=instance.pk)
+                                                  .values_list('user', 'group'))
+    setattr(instance, AFFECTED_USERS_ATTRIBUTE, permission_user_ids(owners))
+
+
+def permission_post_change(sender, instance, **kwargs):
+    if not permission_tracking_enabled():
+        return
+    user_ids = instance.__dict__.pop(AFFECTED_USERS_ATTRIBUTE, None)
+    if user_ids is None:
+        user_ids = permission_user_ids([(instance.user_id, instance.group_id)])
+    user_permissions_changed(user_ids)
+
+
+def m2m_users_changed(instance, action, user_ids_getter):
+    # on clear the affected users are only known before the rows go away,
+    # while the cache and access table can only be updated afterwards
+    if not permission_tracking_enabled():
+        return
+    if action in ('post_add', 'post_remove'):
+        user_permissions_changed(user_ids_getter())
+    elif action == 'pre_clear':
+        setattr(instance, AFFECTED_USERS_ATTRIBUTE, user_ids_getter())
+    elif action == 'post_clear':
+        user_permissions_changed(
+            instance.__dict__.pop(AFFECTED_USERS_ATTRIBUTE, ()))
+
+
+def permission_sites_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    def affected_user_ids():
+        if not reverse:
+            owners = [(instance.user_id, instance.group_id)]
+        elif pk_set is None:
+            # instance is a Site being cleared of all its permissions
+            owners = instance.globalpagepermission_set.values_list('user', 'group')
+        else:
+            owners = (GlobalPagePermission.objects.filter(pk__in=pk_set)
+                                                  .values_list('user', 'group'))
+        return permission_user_ids(owners)
+    m2m_users_changed(instance, action, affected_user_ids)
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    def affected_user_ids():
+        if not reverse:
+            return set([instance.pk])
+        if pk_set is None:
+            # instance is a Group being cleared of all its users
+            return set(instance.user_set.values_list('pk', flat=True))
+        return set(pk_set)
+    m2m_users_changed(instance, action, affected_user_ids)
+
+
+pre_save.connect(permission_pre_change, sender=GlobalPagePermission,
+                 dispatch_uid='restricted_model_admin.permission_pre_save')
+post_save.connect(permission_post_change, sender=GlobalPagePermission,
+                  dispatch_uid='restricted_model_admin.permission_post_save')
+pre_delete.connect(permission_pre_change, sender=GlobalPagePermission,
+                   dispatch_uid='restricted_model_admin.permission_pre_delete')
+post_delete.connect(permission_post_change, sender=GlobalPagePermission,
+                    dispatch_uid='restricted_model_admin.permission_post_delete')
+m2m_changed.connect(permission_sites_changed,
+                    sender=GlobalPagePermission.sites.through,
+                    dispatch_uid='restricted_model_admin.permission_sites_changed')
+m2m_changed.connect(user_groups_changed, sender=User.groups.through,
+                    dispatch_uid='restricted_model_admin.user_groups_changed')
@@ -0,0 +1,47 @@
+(function($) {
+    function search(select, results, term, page) {
+        $.getJSON(select.data('autocomplete-url'), {q: term, page: page}, function(data) {
+            if (page === 1) {
+                results.empty();
+            }
+            results.find('.more').remove();
+            $.each(data.results, function(i, site) {
+                $('<li/>').text(site.text).data('site', site).appendTo(results);
+            });
+            if (data.more) {
+                $('<li class="more"/>').text('...').data('page', page + 1).appendTo(results);
+            }
+        });
+    }
+
+    $(document).ready(function() {
+        $('select.restricted-sites-autocomplete').each(function() {
+            var select = $(this), timer = null,
+                input = $('<input type="text" class="vTextField"/>'),
+                results = $('<ul class="restricted-sites-results"/>');
+            select.before(input).after(results);
+            input.bind('keyup', function() {
+                clearTimeout(timer);
+                timer = setTimeout(function() {
+                    search(select, results, $.trim(input.val()), 1);
+                }, 250);
+            });
+            results.delegate('li', 'click', function() {
+                var item = $(this), site = item.data('site');
+                if (item.hasClass('more')) {
+                    search(select, results, $.trim(input.val()), item.data('page'));
+                } else if (!select.find('option[value="' + site.id + '"]').length) {
+                    $('<option selected="selected"/>').val(site.id).text(site.text).appendTo(select);
+                }
+            });
+            // every rendered option is part of the selection, double clicking
+            // one removes it
+            select.delegate('option', 'dblclick', function() {
+                $(this).remove();
+            });
+            select.closest('form').bind('submit', function() {
+                select.find('option').attr('selected', 'selected');
+            });
+        });
+    });
+})(django.jQuery);
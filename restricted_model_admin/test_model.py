@@ -1,5 +1,5 @@
 from django.db import models
-from models import RestrictedFieldsMixin
+from models import RestrictedFieldsMixin, RestrictedManager
 from django.contrib.sites.models import Site
 from django.utils.translation import ugettext_lazy as _
 
@@ -13,6 +13,8 @@ class TestModel(RestrictedFieldsMixin, models.Model):
         help_text=_('Select on which sites the model will be available.'),
         verbose_name='sites')
 
+    objects = RestrictedManager()
+
     def get_readonly_fields_for_stuff_users(self):
         return ['publish_date'] + \
             super(TestModel, self).get_readonly_fields_for_stuff_users()
\ No newline at end of file
@@ -1,17 +1,53 @@
 from django.test import TestCase
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import User, Group
-from django.contrib.admin.options import ModelAdmin
+from django.contrib.admin.options import ModelAdmin, TabularInline
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import Permission
+from django.test.client import RequestFactory
 from django.conf import settings
+from django.http import QueryDict
+from django.core.paginator import InvalidPage
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.utils import ConnectionDoesNotExist
+from django.test.utils import override_settings
 from cms.models.permissionmodels import GlobalPagePermission
+from django.core.management.base import CommandError
+from management.commands.restricted_site_access import Command as AccessCommand
+from StringIO import StringIO
 from test_model import TestModel
+from models import (UserSiteAccess, RestrictedFieldsMixin,
+                    RestrictedPBSProvidedMixin)
+from policy import restriction_policy
+from selection import queryset_value_chunks, remember_action_queryset
+from widgets import SitesAutocompleteWidget, LockedWidget
+from paginator import RestrictedPaginator, CappedCount
+from instrumentation import AggregateCollector
+from actions import mark_read_only
+from filters import ReadOnlyListFilter
+from django.contrib.admin import SimpleListFilter
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.exceptions import PermissionDenied, ValidationError
+import json
+import sys
+import pickle
 from decorators import \
     (restricted__has_delete_permission__override,
      restricted__get_readonly_fields__override,
      restricted__formfield_for_manytomany__override,
      restricted__queryset__override,
-     append_restricted_fields)
-from mock import Mock
+     append_restricted_fields,
+     restricted_overrides,
+     restricted_inline_overrides,
+     stored_ro_state,
+     ro_states,
+     SUBQUERY_STRATEGY,
+     JOIN_STRATEGY)
+from permissions import get_allowed_site_ids, get_user_group_ids, \
+    user_site_ids, SitePermissionSet
+from mock import Mock, patch
+from export import closing_connection
 
 counter = 0
 
@@ -422,6 +458,229 @@ class TestDecorators(TestCase):
                                  [self.model.id],
                                  lambda o: o.id)
 
+    def _assert_strategies_match(self, restrict_user, include_orphan):
+        @restricted__queryset__override(restrict_user, include_orphan)
+        class JoinModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+
+        @restricted__queryset__override(restrict_user, include_orphan,
+                                        strategy=SUBQUERY_STRATEGY)
+        class SubqueryModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+
+        join_qs = JoinModelAdmin(TestModel, admin_site=None).queryset(self.request)
+        subquery_qs = SubqueryModelAdmin(TestModel, admin_site=None).queryset(self.request)
+        self.assertFalse(subquery_qs.query.distinct)
+        self.assertEqual(sorted(o.id for o in subquery_qs),
+                         sorted(o.id for o in join_qs))
+        self.assertEqual(subquery_qs.count(), join_qs.count())
+
+    def test_queryset_subquery_strategy1(self):
+        self.model.sites = [self.site2, self.site3]
+        self.model.save()
+        create_model(sites=[self.site1, self.site2, self.site3])
+        create_model(sites=[self.site2, self.site3], pbs_provided=True)
+        create_model(sites=[self.site1], pbs_provided=True)
+        create_model(sites=[])
+        create_model(sites=[], pbs_provided=True)
+        group1 = create_group()
+        self.set_request_user(create_user(groups=[group1]))
+        create_globalpagepermission(sites=[self.site1], user=self.request.user)
+        create_globalpagepermission(sites=[self.site1, self.site2], group=group1)
+        for restrict_user in (True, False):
+            for include_orphan in (True, False):
+                self._assert_strategies_match(restrict_user, include_orphan)
+
+    def test_queryset_subquery_strategy2(self):
+        create_model(sites=[self.site2], pbs_provided=True)
+        create_model(sites=[])
+        self.set_request_user(create_user(is_superuser=True))
+        self._assert_strategies_match(True, False)
+
+    def test_queryset_unknown_strategy(self):
+        self.assertRaises(ValueError, restricted__queryset__override,
+                          True, True, strategy='bogus')
+
+    def test_queryset_user_without_permissions(self):
+        @restricted__queryset__override(True, True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+
+        model2 = create_model(sites=[])
+        model3 = create_model(sites=[self.site1], pbs_provided=True)
+        self.set_request_user(self.main_user)
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        self.assertQuerysetEqual(dma.queryset(self.request),
+                                 [model2.id, model3.id],
+                                 lambda o: o.id, ordered=False)
+
+    def test_allowed_site_ids_computed_once_per_request(self):
+        group1 = create_group()
+        self.set_request_user(create_user(groups=[group1]))
+        create_globalpagepermission(sites=[self.site1], user=self.request.user)
+        create_globalpagepermission(sites=[self.site1, self.site2], group=group1)
+        with self.assertNumQueries(2):
+            site_ids = get_allowed_site_ids(self.request)
+        self.assertEqual(site_ids, set([self.site1.id, self.site2.id]))
+        with self.assertNumQueries(0):
+            get_allowed_site_ids(self.request)
+
+    def test_allowed_site_ids_without_groups_skip_group_branch(self):
+        self.set_request_user(create_user())
+        create_globalpagepermission(sites=[self.site1], user=self.request.user)
+        group1 = create_group()
+        create_globalpagepermission(sites=[self.site2], group=group1)
+        with self.assertNumQueries(2):
+            site_ids = get_allowed_site_ids(self.request)
+        self.assertEqual(site_ids, set([self.site1.id]))
+        self.assertEqual(get_user_group_ids(self.request), frozenset())
+
+    def test_group_sites_matched_by_group_ids(self):
+        group1 = create_group()
+        user = create_user(groups=[group1])
+        create_globalpagepermission(sites=[self.site2], group=group1)
+        start = len(connection.queries)
+        with self.settings(DEBUG=True):
+            self.assertEqual(user_site_ids(user, frozenset([group1.pk])),
+                             set([self.site2.id]))
+            sql = connection.queries[start:]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('auth_user_groups', sql[0]['sql'])
+
+    def _fresh_request_site_ids(self, user):
+        request = Mock()
+        request.user = user
+        return get_allowed_site_ids(request)
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_SITE_CACHE=True)
+    def test_allowed_site_ids_cached_across_requests(self):
+        cache.clear()
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id]))
+        with self.assertNumQueries(0):
+            self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                             set([self.site1.id]))
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_SITE_CACHE=True)
+    def test_allowed_site_ids_cache_invalidation(self):
+        cache.clear()
+        group1 = create_group()
+        gpp1 = create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        gpp2 = create_globalpagepermission(sites=[self.site2], group=group1)
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id]))
+
+        self.main_user.groups.add(group1)
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id, self.site2.id]))
+
+        gpp2.sites.add(self.site3)
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id, self.site2.id, self.site3.id]))
+
+        self.site3.globalpagepermission_set.clear()
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id, self.site2.id]))
+
+        gpp1.user = create_user()
+        gpp1.save()
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site2.id]))
+
+        gpp2.delete()
+        self.assertEqual(self._fresh_request_site_ids(self.main_user), set())
+
+    def _access_pairs(self):
+        return set(UserSiteAccess.objects.values_list('user', 'site'))
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_ACCESS_TABLE=True)
+    def test_access_table_maintained_incrementally(self):
+        group1 = create_group()
+        user2 = create_user(groups=[group1])
+        gpp1 = create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        gpp2 = create_globalpagepermission(sites=[self.site2], group=group1)
+        self.assertEqual(self._access_pairs(),
+                         set([(self.main_user.id, self.site1.id),
+                              (user2.id, self.site2.id)]))
+
+        self.main_user.groups.add(group1)
+        gpp2.sites.add(self.site3)
+        self.assertEqual(self._access_pairs(),
+                         set([(self.main_user.id, self.site1.id),
+                              (self.main_user.id, self.site2.id),
+                              (self.main_user.id, self.site3.id),
+                              (user2.id, self.site2.id),
+                              (user2.id, self.site3.id)]))
+
+        group1.user_set.clear()
+        gpp1.delete()
+        self.assertEqual(self._access_pairs(), set())
+        self.assertEqual(UserSiteAccess.objects.verify(), (set(), set()))
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_ACCESS_TABLE=True)
+    def test_access_table_restricts_queryset_and_sites(self):
+        @restricted__queryset__override(True, False)
+        @restricted__formfield_for_manytomany__override(restrict_user=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+
+        model2 = create_model(sites=[self.site2, self.site3])
+        self.set_request_user(self.main_user)
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        self.assertQuerysetEqual(dma.queryset(self.request),
+                                 [self.model.id],
+                                 lambda o: o.id)
+        dma.formfield_for_manytomany(self.db_field, self.request)
+        self.assertQuerysetEqual(dma.test_sites,
+                                 [self.site1.id],
+                                 lambda o: o.id)
+
+    def test_access_table_command(self):
+        gpp1 = create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        command = AccessCommand()
+        command.stdout = StringIO()
+        self.assertRaises(CommandError, command.handle, 'verify')
+        command.handle('rebuild')
+        self.assertEqual(self._access_pairs(),
+                         set([(self.main_user.id, self.site1.id)]))
+        command.handle('verify')
+        self.assertEqual(command.stdout.getvalue().splitlines()[-1],
+                         'The user site access table is in sync.')
+
+    def test_restriction_policy(self):
+        policy = restriction_policy(TestModel, restrict_user=True,
+                                    allways_ro=['publish_date'])
+        self.assertTrue(policy is restriction_policy(
+            TestModel, restrict_user=True, allways_ro=('publish_date',)))
+        self.assertTrue(policy.has_pbs_provided)
+        self.assertTrue(policy.has_read_only)
+        self.assertTrue(policy.has_sites)
+        self.assertEqual(policy.staff_readonly_fields,
+                         ('publish_date', 'pbs_provided', 'read_only'))
+        self.assertEqual(set(policy.all_field_names),
+                         set(TestModel._meta.get_all_field_names()))
+        self.assertRaises(AttributeError, setattr, policy, 'restrict_user', False)
+
+    def test_restricted_overrides_skip_model_introspection(self):
+        @restricted_overrides(restrict_user=True, include_orphan=False,
+                              allways_ro=['publish_date'])
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+
+        self.set_request_user(self.main_user)
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        dma.get_readonly_fields(self.request)
+        # the policy is built, from then on no override introspects the model
+        TestModel._meta.get_all_field_names = Mock(side_effect=AssertionError)
+        try:
+            dma.queryset(self.request).count()
+            dma.get_readonly_fields(self.request)
+            dma.get_readonly_fields(self.request, self.model)
+        finally:
+            del TestModel._meta.get_all_field_names
+
     def test_get_readonly_fields1(self):
         allways_ro=['publish_date']
         @restricted__get_readonly_fields__override(restrict_user=False, allways_ro=allways_ro)
@@ -485,6 +744,68 @@ class TestDecorators(TestCase):
         self.assertEquals(dma.get_readonly_fields(self.request, self.model),\
                           ['publish_date'])
 
+    def _restricted_inline(self, **options):
+        @restricted_inline_overrides(**options)
+        class DecoratedInline(TabularInline):
+            model = TestModel
+
+        @restricted_overrides(restrict_user=True)
+        class ParentModelAdmin(ModelAdmin):
+            pass
+
+        admin_site = AdminSite()
+        admin_site.register(TestModel, ParentModelAdmin)
+        return DecoratedInline(TestModel, admin_site)
+
+    def test_inline_follows_parent_ro_state(self):
+        inline = self._restricted_inline(restrict_user=True,
+                                         allways_ro=['publish_date'])
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='delete_testmodel'))
+        self.set_request_user(User.objects.get(pk=self.main_user.pk))
+        self.request._restricted_model_admin_cache = {}
+        self.assertEqual(inline.get_readonly_fields(self.request, self.model),
+                         ['publish_date', 'pbs_provided', 'read_only'])
+        self.assertTrue(inline.has_delete_permission(self.request, self.model))
+
+        locked = create_model(sites=[self.site1], read_only=True)
+        self.assertEqual(inline.get_readonly_fields(self.request, locked),
+                         locked._meta.get_all_field_names())
+        self.assertFalse(inline.has_delete_permission(self.request, locked))
+
+    def test_inline_shares_parent_request_memo(self):
+        inline = self._restricted_inline(restrict_user=True)
+        self.set_request_user(self.main_user)
+        self.request._restricted_model_admin_cache = {}
+        parent_admin = inline.admin_site._registry[TestModel]
+        # the parent change view decided the object is read only
+        self.model.read_only = True
+        self.assertTrue(parent_admin.get_object_ro_state(self.request, self.model))
+        self.model.read_only = False
+        self.assertFalse(inline.has_delete_permission(self.request, self.model))
+        self.assertEqual(inline.get_readonly_fields(self.request, self.model),
+                         self.model._meta.get_all_field_names())
+
+    def test_inline_sites_share_permitted_sites(self):
+        group = create_group()
+        self.set_request_user(create_user(groups=[group]))
+        create_globalpagepermission(sites=[self.site1], user=self.request.user)
+        self.request._restricted_model_admin_cache = {}
+        inline = self._restricted_inline(restrict_user=True)
+        parent_admin = inline.admin_site._registry[TestModel]
+        sites_field = TestModel._meta.get_field('sites')
+        with self.assertNumQueries(3):
+            parent_field = parent_admin.formfield_for_manytomany(
+                sites_field, self.request)
+            self.assertEqual([pk for pk, label in parent_field.choices],
+                             [self.site1.pk])
+        with self.assertNumQueries(0):
+            inline_field = inline.formfield_for_manytomany(sites_field, self.request)
+            self.assertEqual([pk for pk, label in inline_field.choices],
+                             [self.site1.pk])
+        self.assertRaises(TypeError, restricted_inline_overrides(
+            sites_autocomplete=True), TabularInline)
+
     def test_has_delete_permission1(self):
         @restricted__has_delete_permission__override(restrict_user=False)
         class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
@@ -595,3 +916,781 @@ class TestDecorators(TestCase):
         dma = DecoratedModelAdmin(TestModel, admin_site=None)
         #super_user can delete anything
         self.assertEquals(dma.has_delete_permission(self.request), True)
+
+    def test_has_delete_permission9(self):
+        @restricted__has_delete_permission__override(restrict_user=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+
+        deleted_models = [create_model(sites=[self.site1]) for i in range(5)]
+        deleted_models.append(create_model(sites=[self.site1], pbs_provided=True))
+        self.request.POST = Mock()
+        self.request.POST.getlist.return_value = [m.id for m in deleted_models]
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        #a single query decides for the whole selection
+        with self.assertNumQueries(1):
+            self.assertEquals(dma.has_delete_permission(self.request), False)
+
+    def test_has_delete_permission10(self):
+        @restricted__has_delete_permission__override(restrict_user=True,
+                                                     shared_and_readonly=False)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+
+        deleted_model1 = create_model(sites=[self.site1])
+        deleted_model2 = create_model(sites=[self.site1], pbs_provided=True)
+        self.request.POST = Mock()
+        self.request.POST.getlist.return_value = [deleted_model1.id, deleted_model2.id]
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        #pbs_provided objects are not read only when they are not shared as read only
+        self.assertEquals(dma.has_delete_permission(self.request), True)
+
+    def test_has_delete_permission11(self):
+        @restricted__has_delete_permission__override(restrict_user=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+        self.request.POST = Mock()
+        self.request.POST.getlist.return_value = []
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        #nothing selected, nothing to check
+        with self.assertNumQueries(0):
+            self.assertEquals(dma.has_delete_permission(self.request), True)
+
+    def test_has_delete_permission_select_across1(self):
+        @restricted__has_delete_permission__override(restrict_user=True)
+        @restricted__queryset__override(restrict_user=True, include_orphan=False)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+
+        deleted_model1 = create_model(sites=[self.site1])
+        create_model(sites=[self.site2], read_only=True)
+        self.request.POST = QueryDict('select_across=1&_selected_action=%d'
+                                      % deleted_model1.id)
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        #the read only model is outside the restricted changelist
+        self.assertEquals(dma.has_delete_permission(self.request), True)
+        create_model(sites=[self.site1], read_only=True)
+        self.assertEquals(dma.has_delete_permission(self.request), False)
+
+    def test_has_delete_permission_select_across2(self):
+        @restricted__has_delete_permission__override(restrict_user=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+
+        deleted_model1 = create_model(sites=[self.site1])
+        deleted_model2 = create_model(sites=[self.site1], read_only=True)
+        self.request.POST = QueryDict('select_across=1')
+        #the action runs on a filtered changelist without the read only model
+        remember_action_queryset(self.request, TestModel,
+                                 TestModel.objects.filter(read_only=False))
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        self.assertEquals(dma.has_delete_permission(self.request), True)
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_CHUNK_SIZE=2)
+    def test_has_delete_permission_chunked_selection(self):
+        @restricted__has_delete_permission__override(restrict_user=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user(self.main_user)
+
+        deleted_models = [create_model(sites=[self.site1]) for i in range(5)]
+        self.request.POST = QueryDict('&'.join('_selected_action=%d' % m.id
+                                               for m in deleted_models))
+
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        with self.assertNumQueries(3):
+            self.assertEquals(dma.has_delete_permission(self.request), True)
+
+    def test_queryset_value_chunks(self):
+        models = [self.model] + [create_model(sites=[]) for i in range(6)]
+        chunks = list(queryset_value_chunks(TestModel.objects.all(), ['id'], 3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+        self.assertEqual([row[0] for row in sum(chunks, [])],
+                         sorted(m.id for m in models))
+
+    def test_change_view_single_fetch_and_decision(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        self.model.read_only = True
+        self.model.save()
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.main_user.pk)
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        response = dma.change_view(request, str(self.model.pk))
+        self.assertTrue(response.context_data['read_only'])
+        # the object and its read only state were memoized on the request
+        with self.assertNumQueries(0):
+            obj = dma.get_object(request, str(self.model.pk))
+            self.assertTrue(obj is dma.get_object(request, self.model.pk))
+            self.assertEqual(dma.get_readonly_fields(request, obj),
+                             TestModel._meta.get_all_field_names())
+            self.assertFalse(dma.has_delete_permission(request, obj))
+
+    def test_change_view_precheck_reads_flags_only(self):
+        self.set_request_user(self.main_user)
+        self.model.pbs_provided = True
+        self.model.save()
+        policy = restriction_policy(TestModel, restrict_user=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(stored_ro_state(policy, self.request, self.model.pk))
+            self.assertTrue(stored_ro_state(policy, self.request, str(self.model.pk)))
+        self.assertFalse(stored_ro_state(policy, self.request, 'bogus'))
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_AUTOCOMPLETE_PAGE_SIZE=2)
+    def test_sites_autocomplete_view(self):
+        @restricted__formfield_for_manytomany__override(restrict_user=True,
+                                                        sites_autocomplete=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            def has_change_permission(self, request, obj=None):
+                return True
+
+        site4 = create_site(domain='other.org')
+        create_globalpagepermission(sites=[self.site1, self.site2, self.site3, site4],
+                                    user=self.main_user)
+        create_site(domain='forbidden.org')
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        self.assertTrue(any(getattr(pattern, 'name', None) ==
+                            'restricted_model_admin_testmodel_sites_autocomplete'
+                            for pattern in dma.get_urls()))
+
+        def fetch(**params):
+            request = RequestFactory().get('/', params)
+            request.user = self.main_user
+            return json.loads(dma.sites_autocomplete_view(request).content)
+
+        page1 = fetch()
+        self.assertEqual([r['id'] for r in page1['results']],
+                         [self.site1.id, self.site2.id])
+        self.assertTrue(page1['more'])
+        page2 = fetch(page=2)
+        self.assertEqual([r['id'] for r in page2['results']],
+                         [self.site3.id, site4.id])
+        self.assertFalse(page2['more'])
+        self.assertEqual([r['text'] for r in fetch(q='org')['results']],
+                         [self.site1.domain, self.site2.domain])
+        self.assertEqual(fetch(q='other')['results'],
+                         [{'id': site4.id, 'text': 'other.org'}])
+
+    def test_sites_autocomplete_widget(self):
+        @restricted__formfield_for_manytomany__override(restrict_user=True,
+                                                        sites_autocomplete=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+
+        create_globalpagepermission(sites=[self.site1, self.site2],
+                                    user=self.main_user)
+        self.set_request_user(self.main_user)
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        field = dma.formfield_for_manytomany(TestModel._meta.get_field('sites'),
+                                            self.request)
+        self.assertTrue(isinstance(field.widget, SitesAutocompleteWidget))
+        widget = SitesAutocompleteWidget('/sites/')
+        widget.choices = field.choices
+        html = widget.render('sites', [self.site2.id, self.site3.id])
+        # only the selected, permitted site is rendered
+        self.assertTrue(self.site2.domain in html)
+        self.assertFalse(self.site1.domain in html)
+        self.assertFalse(self.site3.domain in html)
+        self.assertTrue('data-autocomplete-url="/sites/"' in html)
+
+    def test_capped_count(self):
+        for i in range(4):
+            create_model(sites=[])
+        paginator = RestrictedPaginator(TestModel.objects.order_by('pk'), 2,
+                                        count_mode='capped', count_cap=3)
+        with self.assertNumQueries(1):
+            self.assertTrue(isinstance(paginator.count, CappedCount))
+        self.assertEqual(unicode(paginator.count), u'3+')
+        self.assertEqual(paginator.num_pages, 2)
+        # pages past the cap are still served
+        self.assertEqual(len(paginator.page(3).object_list), 1)
+        self.assertRaises(InvalidPage, paginator.page, 4)
+        paginator = RestrictedPaginator(TestModel.objects.all(), 2,
+                                        count_mode='capped', count_cap=10)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(isinstance(paginator.count, CappedCount))
+
+    def test_cached_count(self):
+        cache.clear()
+        create_model(sites=[])
+        queryset = TestModel.objects.filter(read_only=False)
+        self.assertEqual(RestrictedPaginator(queryset, 2, count_mode='cached').count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(RestrictedPaginator(queryset, 2, count_mode='cached').count, 2)
+
+    def test_changelist_counts(self):
+        @restricted__queryset__override(restrict_user=True, include_orphan=True,
+                                        count_mode='capped', count_cap=2)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_per_page = 2
+            list_filter = ('read_only', )
+
+        for i in range(3):
+            create_model(sites=[])
+        create_model(sites=[], read_only=True)
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+
+        def changelist(**params):
+            request = RequestFactory().get('/', params)
+            request.user = User.objects.get(pk=self.main_user.pk)
+            return dma.changelist_view(request).context_data['cl']
+
+        cl = changelist()
+        self.assertEqual(unicode(cl.result_count), u'2+')
+        self.assertTrue(cl.full_result_count is cl.result_count)
+        cl = changelist(read_only__exact=1)
+        self.assertEqual(cl.result_count, 1)
+        self.assertEqual(unicode(cl.full_result_count), u'2+')
+
+    def test_changelist_full_count_with_emptying_filter(self):
+        class NothingListFilter(SimpleListFilter):
+            title = 'nothing'
+            parameter_name = 'nothing'
+
+            def lookups(self, request, model_admin):
+                return (('1', 'Nothing'), )
+
+            def queryset(self, request, queryset):
+                if self.value():
+                    return queryset.none()
+
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_filter = (NothingListFilter, )
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+
+        def changelist(**params):
+            request = RequestFactory().get('/', params)
+            request.user = User.objects.get(pk=self.main_user.pk)
+            return dma.changelist_view(request).context_data['cl']
+
+        cl = changelist()
+        self.assertEqual((cl.result_count, cl.full_result_count), (1, 1))
+        cl = changelist(nothing='1')
+        self.assertEqual((cl.result_count, cl.full_result_count), (0, 1))
+
+    def test_capped_changelist_cannot_show_all(self):
+        @restricted_overrides(restrict_user=True, count_mode='capped', count_cap=5)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_per_page = 2
+            list_max_show_all = 20
+        for i in range(9):
+            create_model(sites=[])
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().get('/', {'all': ''})
+        request.user = User.objects.get(pk=self.main_user.pk)
+        cl = dma.changelist_view(request).context_data['cl']
+        self.assertFalse(cl.can_show_all)
+        self.assertEqual(len(cl.result_list), 2)
+
+    def test_unknown_count_mode(self):
+        self.assertRaises(ValueError, restricted__queryset__override,
+                          True, True, count_mode='bogus')
+
+    def test_instrumentation_disabled(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        self.assertFalse(hasattr(DecoratedModelAdmin.__dict__['queryset'],
+                                 'instrumented'))
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_INSTRUMENTATION=True)
+    def test_instrumentation_collects_calls(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        collector = AggregateCollector().connect()
+        try:
+            self.set_request_user()
+            dma = DecoratedModelAdmin(TestModel, AdminSite())
+            list(dma.queryset(self.request))
+            dma.get_readonly_fields(self.request, self.model)
+        finally:
+            collector.disconnect()
+        totals = collector.totals
+        queryset = totals[(DecoratedModelAdmin, 'queryset')]
+        self.assertEqual(queryset['calls'], 1)
+        self.assertEqual(queryset['decorator'], 'queryset')
+        # the allowed sites are resolved inside the call, the rows are
+        # fetched by the caller from the returned lazy queryset
+        self.assertEqual(queryset['queries'], 2)
+        self.assertEqual(queryset['rows'], 0)
+        readonly = totals[(DecoratedModelAdmin, 'get_readonly_fields')]
+        self.assertEqual((readonly['calls'], readonly['queries']), (1, 0))
+        self.assertEqual(len(collector.summary()), 2)
+
+    def test_flag_actions_offered_to_superusers_only(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().get('/')
+        request.user = self.main_user
+        self.assertFalse('mark_read_only' in dma.get_actions(request))
+        request.user.is_superuser = True
+        self.assertEqual([name for name in dma.get_actions(request)
+                          if 'mark_' in name],
+                         ['mark_pbs_provided', 'unmark_pbs_provided',
+                          'mark_read_only', 'unmark_read_only'])
+
+        @restricted_overrides(restrict_user=True, flag_actions=False)
+        class UnflaggedModelAdmin(ModelAdmin):
+            pass
+        dma = UnflaggedModelAdmin(TestModel, AdminSite())
+        self.assertFalse('mark_read_only' in dma.get_actions(request))
+
+    def test_flag_action_select_across(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_filter = ('pbs_provided', )
+        shared1 = create_model(sites=[self.site1], pbs_provided=True)
+        shared2 = create_model(sites=[], pbs_provided=True)
+        self.main_user.is_staff = self.main_user.is_superuser = True
+        self.main_user.save()
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().post('/?pbs_provided__exact=1', {
+            'action': 'mark_read_only', 'index': 0, 'select_across': 1,
+            '_selected_action': [shared1.pk]})
+        request.user = self.main_user
+        request._messages = CookieStorage(request)
+        request._dont_enforce_csrf_checks = True
+        dma.changelist_view(request)
+        self.assertEqual(
+            set(TestModel.objects.filter(read_only=True).values_list('pk', flat=True)),
+            set([shared1.pk, shared2.pk]))
+        self.assertEqual([m.message for m in request._messages._queued_messages],
+                         [u'2 test models marked as read only.'])
+
+        request.user = Mock(is_superuser=False)
+        self.assertRaises(PermissionDenied, mark_read_only, dma, request,
+                          TestModel.objects.all())
+
+    def test_restriction_columns_indexed(self):
+        cursor = connection.cursor()
+        indexes = connection.introspection.get_indexes(
+            cursor, TestModel._meta.db_table)
+        self.assertTrue('pbs_provided' in indexes)
+        self.assertTrue('read_only' in indexes)
+        # the orphan check looks the objects up in the sites table
+        through = TestModel.sites.through._meta
+        indexes = connection.introspection.get_indexes(cursor, through.db_table)
+        self.assertTrue(through.get_field('testmodel').column in indexes)
+
+    def test_read_only_annotation(self):
+        @restricted__queryset__override(restrict_user=True, annotate_read_only=True)
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        self.set_request_user()
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        read_only = create_model(sites=[self.site1], read_only=True)
+        shared = create_model(sites=[], pbs_provided=True)
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        queryset = dma.queryset(self.request)
+        with self.assertNumQueries(1):
+            rows = list(queryset)
+        self.assertEqual(dict((obj.pk, bool(obj.is_read_only)) for obj in rows),
+                         {self.model.pk: False, read_only.pk: True, shared.pk: True})
+        self.assertEqual([dma.is_read_only(obj) for obj in rows],
+                         [bool(obj.is_read_only) for obj in rows])
+
+        @restricted__queryset__override(restrict_user=True, annotate_read_only=True,
+                                        shared_and_readonly=False)
+        class UnsharedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        rows = UnsharedModelAdmin(TestModel, admin_site=None).queryset(self.request)
+        self.assertEqual(dict((obj.pk, bool(obj.is_read_only)) for obj in rows),
+                         {self.model.pk: False, read_only.pk: True, shared.pk: False})
+
+    def test_read_only_list_filter(self):
+        @restricted_overrides(restrict_user=True, annotate_read_only=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_display = ('test_field1', 'is_read_only')
+            list_filter = (ReadOnlyListFilter, )
+        read_only = create_model(sites=[], read_only=True)
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+
+        def changelist(**params):
+            request = RequestFactory().get('/', params)
+            request.user = User.objects.get(pk=self.main_user.pk)
+            return dma.changelist_view(request).context_data['cl']
+
+        cl = changelist(is_read_only='1')
+        self.assertEqual([obj.pk for obj in cl.result_list], [read_only.pk])
+        cl = changelist(is_read_only='0', o='2')
+        self.assertEqual([obj.pk for obj in cl.result_list], [self.model.pk])
+        self.assertEqual(cl.full_result_count, 2)
+
+    def test_prefetch_changelist_sites(self):
+        @restricted_overrides(restrict_user=True, prefetch_sites=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        create_globalpagepermission(sites=[self.site1, self.site2],
+                                    user=self.main_user)
+        for i in range(5):
+            create_model(sites=[self.site2, self.site3])
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.main_user.pk)
+        cl = dma.changelist_view(request).context_data['cl']
+        rows = cl.query_set._clone()
+        # the rows and the permitted sites of all of them
+        with self.assertNumQueries(2):
+            sites = dict((obj.pk, sorted(site.pk for site in obj.sites.all()))
+                         for obj in rows)
+        self.assertEqual(len(sites), 6)
+        self.assertEqual(sites[self.model.pk], [self.site1.pk, self.site2.pk])
+        self.assertEqual(set(map(tuple, sites.values())),
+                         set([(self.site1.pk, self.site2.pk), (self.site2.pk, )]))
+
+        request.user.is_superuser = True
+        rows = dma.prefetch_changelist_sites(request, TestModel.objects.all())
+        with self.assertNumQueries(2):
+            self.assertEqual(sorted(site.pk for site in list(rows)[0].sites.all()),
+                             [self.site1.pk, self.site2.pk, self.site3.pk])
+
+    def test_restricted_for_matches_admin(self):
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        create_model(sites=[self.site2])
+        create_model(sites=[self.site2], pbs_provided=True)
+        create_model(sites=[])
+        superuser = create_user(is_superuser=True)
+        for strategy in (JOIN_STRATEGY, SUBQUERY_STRATEGY):
+            for include_orphan in (True, False):
+                options = dict(restrict_user=True, include_orphan=include_orphan,
+                               strategy=strategy)
+
+                @restricted__queryset__override(**options)
+                class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+                    pass
+                dma = DecoratedModelAdmin(TestModel, admin_site=None)
+                for user in (self.main_user, superuser):
+                    request = Mock()
+                    request.user = user
+                    expected = sorted(dma.queryset(request).values_list('pk', flat=True))
+                    self.assertEqual(
+                        list(TestModel.objects.restricted_for(user, pks_only=True, **options)),
+                        expected)
+                    self.assertEqual(
+                        [obj.pk for obj in TestModel.objects.restricted_for(
+                            user, **options).iterator()],
+                        expected)
+
+    def test_mixins_keep_model_managers(self):
+        self.assertEqual(RestrictedFieldsMixin._meta.abstract_managers, [])
+        self.assertEqual(RestrictedPBSProvidedMixin._meta.abstract_managers, [])
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_CHUNK_SIZE=2)
+    def test_export_actions_stream_restricted_rows(self):
+        @restricted_overrides(restrict_user=True, include_orphan=False,
+                              export_actions=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            export_fields = ('test_field1', 'read_only', 'publish_date')
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        visible = [self.model] + [create_model(sites=[self.site1]) for i in range(2)]
+        create_model(sites=[])
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+
+        def export(action):
+            request = RequestFactory().post('/', {
+                'action': action, 'index': 0, 'select_across': 1,
+                '_selected_action': [self.model.pk]})
+            request.user = User.objects.get(pk=self.main_user.pk)
+            request._dont_enforce_csrf_checks = True
+            return dma.changelist_view(request)
+
+        response = export('export_csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        # rows are fetched while the body is iterated, a chunk at a time
+        with self.assertNumQueries(2):
+            lines = ''.join(response).splitlines()
+        self.assertEqual(lines, ['test_field1,read_only,publish_date'] +
+                         ['%s,False,' % obj.test_field1 for obj in visible])
+
+        response = export('export_jsonl')
+        rows = [json.loads(line) for line in ''.join(response).splitlines()]
+        self.assertEqual([row['test_field1'] for row in rows],
+                         [obj.test_field1 for obj in visible])
+        self.assertEqual(rows[0], {'test_field1': self.model.test_field1,
+                                   'read_only': False, 'publish_date': None})
+
+    def test_export_closes_connection_after_body(self):
+        connection = Mock()
+        connection.is_managed.return_value = False
+        export_module = sys.modules[closing_connection.__module__]
+        with patch.object(export_module, 'connections', {'other': connection}):
+            body = closing_connection(iter(['a', 'b']), 'other')
+            self.assertEqual(list(body), ['a', 'b'])
+            self.assertEqual(connection.close.call_count, 1)
+            # the server closes the response before the end of the body
+            body = closing_connection(iter(['a', 'b']), 'other')
+            next(body)
+            body.close()
+            self.assertEqual(connection.close.call_count, 2)
+            connection.is_managed.return_value = True
+            list(closing_connection(iter(['a']), 'other'))
+            self.assertEqual(connection.close.call_count, 2)
+
+    def test_site_permission_set(self):
+        site_set = SitePermissionSet([3, 1, 64, '200'])
+        self.assertEqual(sorted(site_set), [1, 3, 64, 200])
+        self.assertEqual(len(site_set), 4)
+        self.assertTrue(64 in site_set)
+        self.assertTrue('3' in site_set)
+        self.assertFalse(2 in site_set)
+        self.assertFalse(-1 in site_set)
+        self.assertFalse('bogus' in site_set)
+        self.assertTrue(site_set.issuperset([1, '200']))
+        self.assertFalse(site_set.issuperset([1, 2]))
+        self.assertEqual(site_set, set([1, 3, 64, 200]))
+        self.assertEqual(site_set, frozenset([1, 3, 64, 200]))
+        self.assertEqual(hash(site_set), hash(frozenset([1, 3, 64, 200])))
+        self.assertTrue(SitePermissionSet([1]).issubset(site_set))
+        self.assertEqual(site_set & set([3, 4]), set([3]))
+        self.assertFalse(SitePermissionSet())
+        self.assertEqual(pickle.loads(pickle.dumps(site_set)), site_set)
+        self.assertEqual(pickle.loads(pickle.dumps(site_set, 2)), site_set)
+        # the pickled size follows the number of sites, not the largest id
+        self.assertTrue(len(pickle.dumps(SitePermissionSet([3, 5000000]), 2)) < 200)
+
+        create_globalpagepermission(sites=[self.site1, self.site3],
+                                    user=self.main_user)
+        site_ids = self._fresh_request_site_ids(self.main_user)
+        self.assertTrue(isinstance(site_ids, SitePermissionSet))
+        self.assertEqual(site_ids, set([self.site1.pk, self.site3.pk]))
+        self.assertEqual(list(Site.objects.filter(pk__in=site_ids)
+                                          .order_by('pk').values_list('pk', flat=True)),
+                         [self.site1.pk, self.site3.pk])
+
+    def test_read_database_option_reaches_site_resolution(self):
+        @restricted__queryset__override(restrict_user=True, read_database='nowhere')
+        class DecoratedModelAdmin(ToBeDecoratedModelAdmin):
+            pass
+        dma = DecoratedModelAdmin(TestModel, admin_site=None)
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        request = RequestFactory().get('/')
+        request.user = self.main_user
+        self.assertRaises(ConnectionDoesNotExist, dma.queryset, request)
+        # requests that may write check the permissions on the primary
+        request = RequestFactory().post('/')
+        request.user = self.main_user
+        self.assertEqual(list(dma.queryset(request)), [self.model])
+
+    @override_settings(RESTRICTED_MODEL_ADMIN_SITE_CACHE=True,
+                       RESTRICTED_MODEL_ADMIN_READ_DATABASE='nowhere')
+    def test_site_cache_refilled_from_primary(self):
+        cache.clear()
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        self.assertEqual(self._fresh_request_site_ids(self.main_user),
+                         set([self.site1.id]))
+
+    def test_read_database(self):
+        @restricted_overrides(restrict_user=True, read_database='replica')
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        # the replica alias reuses the test database connection
+        connections['replica'] = connections['default']
+        self.addCleanup(delattr, connections._connections, 'replica')
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.main_user.pk)
+
+        cl = dma.changelist_view(request).context_data['cl']
+        self.assertEqual(cl.result_list.db, 'replica')
+        self.assertEqual([obj.pk for obj in cl.result_list], [self.model.pk])
+        # actions and edited objects use the primary
+        self.assertEqual(cl.get_query_set(request).db, 'default')
+        self.assertEqual(dma.get_object(request, self.model.pk)._state.db, 'default')
+
+        field = dma.formfield_for_manytomany(TestModel._meta.get_field('sites'), request)
+        self.assertEqual(field.choices.queryset.db, 'replica')
+        self.assertEqual([pk for pk, label in field.choices], [self.site1.pk])
+        self.assertEqual([site._state.db for site in field.clean([self.site1.pk])],
+                         ['default'])
+
+        dma.list_editable = ('test_field1', )
+        dma.list_display = ('pk', 'test_field1')
+        cl = dma.changelist_view(request).context_data['cl']
+        self.assertEqual(cl.result_list.db, 'default')
+
+    def test_sites_field_validates_against_permitted_site_ids(self):
+        @restricted__formfield_for_manytomany__override(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        create_globalpagepermission(sites=[self.site1, self.site2],
+                                    user=self.main_user)
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().post('/')
+        request.user = self.main_user
+        get_allowed_site_ids(request)
+        field = dma.formfield_for_manytomany(TestModel._meta.get_field('sites'), request)
+        with self.assertNumQueries(0):
+            self.assertRaises(ValidationError, field.clean, [self.site3.pk])
+            self.assertRaises(ValidationError, field.clean, ['bogus'])
+        # only the selected sites are fetched
+        with self.assertNumQueries(1):
+            self.assertEqual(field.clean([str(self.site2.pk), self.site1.pk]),
+                             [self.site2, self.site1])
+        self.assertEqual(field.site_cache, {})
+        with self.assertNumQueries(1):
+            # the form is rendered again after the errors
+            self.assertEqual(sorted(pk for pk, label in field.choices),
+                             [self.site1.pk, self.site2.pk])
+            # and the rendered sites are reused, by a new field too
+            self.assertEqual(field.clean([self.site1.pk]), [self.site1])
+            field = dma.formfield_for_manytomany(TestModel._meta.get_field('sites'),
+                                                 request)
+            self.assertEqual(field.clean([self.site2.pk]), [self.site2])
+        self.assertEqual(field.clean([]), [])
+
+    def test_sites_field_checks_submitted_sites_on_the_primary(self):
+        @restricted__formfield_for_manytomany__override(
+            restrict_user=True, read_database='nowhere')
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        # the read database is unreachable, so it holds no permission at all
+        create_globalpagepermission(sites=[self.site1], user=self.main_user)
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        sites_field = TestModel._meta.get_field('sites')
+        request = RequestFactory().post('/')
+        request.user = self.main_user
+        field = dma.formfield_for_manytomany(sites_field, request)
+        self.assertEqual(field.allowed_site_ids, set([self.site1.pk]))
+        self.assertEqual(field.clean([self.site1.pk]), [self.site1])
+        self.assertRaises(ValidationError, field.clean, [self.site2.pk])
+        request = RequestFactory().get('/')
+        request.user = self.main_user
+        self.assertRaises(ConnectionDoesNotExist,
+                          dma.formfield_for_manytomany, sites_field, request)
+
+    def test_sites_field_fetches_selected_sites_for_superusers(self):
+        @restricted__formfield_for_manytomany__override(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        request = RequestFactory().post('/')
+        request.user = create_user(is_superuser=True)
+        field = dma.formfield_for_manytomany(TestModel._meta.get_field('sites'), request)
+        with self.assertNumQueries(1):
+            self.assertEqual(field.clean([str(self.site3.pk)]), [self.site3])
+        self.assertEqual(field.site_cache, {})
+        self.assertRaises(ValidationError, field.clean, [self.site3.pk + 100])
+
+    def test_ro_states(self):
+        read_only = create_model(sites=[], read_only=True)
+        shared = create_model(sites=[], pbs_provided=True)
+        pks = [self.model.pk, read_only.pk, shared.pk]
+        expected = {self.model.pk: False, read_only.pk: True, shared.pk: True}
+        with self.assertNumQueries(1):
+            self.assertEqual(ro_states(TestModel, [str(pk) for pk in pks]), expected)
+        with self.assertNumQueries(1):
+            self.assertEqual(ro_states(TestModel, TestModel.objects.filter(pk__in=pks)),
+                             expected)
+        objects = list(TestModel.objects.filter(pk__in=pks))
+        with self.assertNumQueries(0):
+            self.assertEqual(ro_states(TestModel, objects), expected)
+            self.assertEqual(ro_states(TestModel, []), {})
+        self.assertEqual(ro_states(TestModel, pks, shared_and_readonly=False),
+                         {self.model.pk: False, read_only.pk: True, shared.pk: False})
+
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            pass
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        self.set_request_user()
+        dma.get_ro_states(self.request, pks)
+        # the page decision is reused by the per object checks
+        with self.assertNumQueries(0):
+            self.assertTrue(stored_ro_state(restriction_policy(
+                TestModel, restrict_user=True), self.request, read_only.pk))
+
+    def test_list_editable_locks_read_only_rows(self):
+        @restricted_overrides(restrict_user=True)
+        class DecoratedModelAdmin(ModelAdmin):
+            list_display = ('pk', 'test_field1')
+            list_editable = ('test_field1', )
+        read_only = create_model(sites=[], read_only=True)
+        editable = create_model(sites=[])
+        self.main_user.is_staff = True
+        self.main_user.save()
+        self.main_user.user_permissions.add(
+            Permission.objects.get(codename='change_testmodel'))
+        dma = DecoratedModelAdmin(TestModel, AdminSite())
+        data = {'form-TOTAL_FORMS': 2, 'form-INITIAL_FORMS': 2,
+                'form-MAX_NUM_FORMS': '', '_save': 'Save'}
+        for i, obj in enumerate(TestModel.objects.filter(sites__isnull=True)
+                                                 .order_by('-pk')):
+            data['form-%d-id' % i] = obj.pk
+            if obj.pk == editable.pk:
+                # locked rows have no input, the browser posts nothing for them
+                data['form-%d-test_field1' % i] = 'changed%d' % obj.pk
+        request = RequestFactory().post('/', data)
+        request.user = User.objects.get(pk=self.main_user.pk)
+        request._dont_enforce_csrf_checks = True
+        request._messages = CookieStorage(request)
+        dma.changelist_view(request)
+        self.assertEqual(TestModel.objects.get(pk=editable.pk).test_field1,
+                         'changed%d' % editable.pk)
+        self.assertEqual(TestModel.objects.get(pk=read_only.pk).test_field1,
+                         read_only.test_field1)
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.main_user.pk)
+        formset = dma.changelist_view(request).context_data['cl'].formset
+        locked = [form.instance.pk for form in formset.forms
+                  if isinstance(form.fields['test_field1'].widget, LockedWidget)]
+        self.assertEqual(locked, [read_only.pk])
+        form = [form for form in formset.forms if form.instance.pk == read_only.pk][0]
+        self.assertEqual(unicode(form['test_field1']),
+                         u'<span class="restricted-locked">%s</span>'
+                         % read_only.test_field1)
+        self.assertTrue('<input' in unicode(form['id']))
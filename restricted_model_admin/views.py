@@ -0,0 +1,33 @@
+import json
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse
+
+
+def autocomplete_page_size():
+    return getattr(settings, 'RESTRICTED_MODEL_ADMIN_AUTOCOMPLETE_PAGE_SIZE', 20)
+
+
+def sites_autocomplete_response(request, sites):
+    """Serves one page of ``sites`` matching the ``q`` GET parameter as JSON:
+    ``{"results": [{"id": ..., "text": ...}], "more": bool}``.
+
+    One row past the page is fetched to tell whether there are more, so no
+    COUNT query is needed.
+    """
+    term = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    if term:
+        sites = sites.filter(Q(domain__icontains=term) | Q(name__icontains=term))
+    size = autocomplete_page_size()
+    start = (page - 1) * size
+    rows = list(sites.order_by('domain', 'pk')
+                     .values_list('pk', 'domain')[start:start + size + 1])
+    data = {
+        'results': [{'id': pk, 'text': domain} for pk, domain in rows[:size]],
+        'more': len(rows) > size,
+    }
+    return HttpResponse(json.dumps(data), content_type='application/json')
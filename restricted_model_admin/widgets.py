@@ -0,0 +1,68 @@
+import copy
+from django import forms
+from django.utils.encoding import force_unicode
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext as _
+
+
+class SitesAutocompleteWidget(forms.SelectMultiple):
+    """
+    Multiple select that only renders the selected sites; the other permitted
+    sites are searched through the paginated JSON view at ``url`` as the user
+    types.
+    """
+
+    class Media:
+        js = ('restricted_model_admin/js/sites_autocomplete.js', )
+
+    def __init__(self, url, attrs=None):
+        super(SitesAutocompleteWidget, self).__init__(attrs)
+        self.url = url
+
+    def render(self, name, value, attrs=None, choices=()):
+        attrs = dict(attrs or {})
+        attrs['class'] = 'restricted-sites-autocomplete'
+        attrs['data-autocomplete-url'] = force_unicode(self.url)
+        widget = copy.copy(self)
+        widget.choices = self.selected_choices(value)
+        return super(SitesAutocompleteWidget, widget).render(name, value, attrs)
+
+    def selected_choices(self, value):
+        selected = [v for v in (value or []) if force_unicode(v).isdigit()]
+        if not selected:
+            return []
+        # the field queryset keeps the choices limited to the permitted sites
+        sites = self.choices.queryset.filter(pk__in=selected)
+        return [(site.pk, force_unicode(site)) for site in sites]
+
+
+class LockedWidget(forms.Widget):
+    """
+    Renders the value of a locked field as text, without any input, and
+    reads back ``value`` whatever is posted.  ``widget`` is the widget it
+    replaces, used to show the labels of choices.
+    """
+
+    def __init__(self, widget, value, attrs=None):
+        super(LockedWidget, self).__init__(attrs)
+        self.widget = widget
+        self.value = value
+
+    def value_from_datadict(self, data, files, name):
+        return self.value
+
+    def render(self, name, value, attrs=None):
+        return mark_safe(u'<span class="restricted-locked">%s</span>'
+                         % conditional_escape(self.display(value)))
+
+    def display(self, value):
+        if isinstance(self.widget, forms.CheckboxInput):
+            return _('Yes') if value else _('No')
+        choices = getattr(self.widget, 'choices', None)
+        if choices is None:
+            return u'' if value is None else force_unicode(value)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        labels = dict((force_unicode(k), v) for k, v in choices)
+        return u', '.join(force_unicode(labels.get(force_unicode(v), v))
+                          for v in values if v not in (None, ''))
@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+from os.path import dirname, abspath
+from optparse import OptionParser
+
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from django.conf import settings
+if not settings.configured:
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings_test'
+
+
+def runbenchmarks(scales=(1, ), repeat=5, output=None, **sizes):
+    """Generates a dataset per scale factor in a throwaway test database and
+    writes one JSON line per scenario result to ``output``.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from benchmarks import (DEFAULT_SIZES, generate_dataset, clear_dataset,
+                            run_benchmarks)
+
+    output = output or sys.stdout
+    base_sizes = dict(DEFAULT_SIZES, **dict((k, v) for k, v in sizes.items() if v))
+    if 'south' in settings.INSTALLED_APPS:
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+    setup_test_environment()
+    old_name = settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        for scale in scales:
+            dataset = generate_dataset(**dict((name, int(size * scale))
+                                              for name, size in base_sizes.items()))
+            for result in run_benchmarks(dataset, repeat=repeat):
+                result['scale'] = scale
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+                output.flush()
+            clear_dataset()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--scales', dest='scales', default='1',
+                      help='comma separated multipliers applied to every size')
+    parser.add_option('--repeat', dest='repeat', type=int, default=5)
+    parser.add_option('--output', dest='output', default=None,
+                      help='file receiving the JSON lines, stdout by default')
+    for name in ('sites', 'users', 'groups', 'permissions', 'objects'):
+        parser.add_option('--%s' % name, dest=name, type=int, default=None)
+    (options, args) = parser.parse_args()
+    output = open(options.output, 'w') if options.output else None
+    try:
+        runbenchmarks(scales=[float(s) for s in options.scales.split(',')],
+                      repeat=options.repeat, output=output,
+                      sites=options.sites, users=options.users,
+                      groups=options.groups, permissions=options.permissions,
+                      objects=options.objects)
+    finally:
+        if output:
+            output.close()
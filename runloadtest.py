@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import tempfile
+from os.path import dirname, abspath, join
+from optparse import OptionParser
+
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from django.conf import settings
+if not settings.configured:
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings_test'
+
+
+def runloadtest(scales=(1, ), sessions=20, threads=8, requests=10,
+                superuser_ratio=0.2, modes=None, database=None, output=None,
+                **sizes):
+    """Generates a dataset per scale factor in a throwaway file-backed test
+    database, shared by the threads, and writes one JSON line per view and
+    admin mode to ``output``.
+    """
+    from django.db import connection
+    from benchmarks import DEFAULT_SIZES, generate_dataset, clear_dataset
+    from loadtest import MODES, run_load
+
+    output = output or sys.stdout
+    base_sizes = dict(DEFAULT_SIZES, **dict((k, v) for k, v in sizes.items() if v))
+    if 'south' in settings.INSTALLED_APPS:
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+    # an in-memory sqlite database is private to the connection creating it
+    settings.DATABASES['default']['TEST_NAME'] = (
+        database or join(tempfile.gettempdir(), 'restricted_model_admin_load.db'))
+    old_name = settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        for scale in scales:
+            dataset = generate_dataset(**dict((name, int(size * scale))
+                                              for name, size in base_sizes.items()))
+            for result in run_load(dataset, sessions=sessions, threads=threads,
+                                   requests=requests,
+                                   superuser_ratio=superuser_ratio,
+                                   modes=modes or MODES):
+                result['scale'] = scale
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+                output.flush()
+            clear_dataset()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--scales', dest='scales', default='1',
+                      help='comma separated multipliers applied to every size')
+    parser.add_option('--sessions', dest='sessions', type=int, default=20,
+                      help='number of concurrent logged in sessions')
+    parser.add_option('--threads', dest='threads', type=int, default=8)
+    parser.add_option('--requests', dest='requests', type=int, default=10,
+                      help='requests per session and view')
+    parser.add_option('--superusers', dest='superuser_ratio', type=float,
+                      default=0.2, help='share of superuser sessions')
+    parser.add_option('--modes', dest='modes', default='decorated,undecorated',
+                      help='comma separated admin modes to compare')
+    parser.add_option('--database', dest='database', default=None,
+                      help='sqlite file of the test database')
+    parser.add_option('--output', dest='output', default=None,
+                      help='file receiving the JSON lines, stdout by default')
+    for name in ('sites', 'users', 'groups', 'permissions', 'objects'):
+        parser.add_option('--%s' % name, dest=name, type=int, default=None)
+    (options, args) = parser.parse_args()
+    output = open(options.output, 'w') if options.output else None
+    try:
+        runloadtest(scales=[float(s) for s in options.scales.split(',')],
+                    sessions=options.sessions, threads=options.threads,
+                    requests=options.requests,
+                    superuser_ratio=options.superuser_ratio,
+                    modes=options.modes.split(','), database=options.database,
+                    output=output, sites=options.sites, users=options.users,
+                    groups=options.groups, permissions=options.permissions,
+                    objects=options.objects)
+    finally:
+        if output:
+            output.close()